@@ -1,75 +1,45 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_from_directory
-import sqlite3
+from flask import Blueprint, Flask, Response, g, render_template, request, jsonify, session, redirect, url_for, send_file, send_from_directory
 import random
 import string
 import hashlib
+import atexit
 import os
+import shutil
+import tempfile
+import time
 from datetime import datetime
-import base64
-from PIL import Image, ImageDraw, ImageFont
-from PIL.PngImagePlugin import PngInfo
-import io
-import json
+import blob_store
+import conversations
+import database
+import decrypt_codes
+import events
+import lsb
+import metrics
+import expiry
+import migrations
+import otp_store
+import rate_limit
+import render_pool
+import sticker_cache
+import stickers
+import timeline
+import user_cache
+import write_queue
+from config import PROFILES
+from steganography import PAYLOAD_MODES, DEFAULT_PAYLOAD_MODE, extract_from_steganography, payload_size
 
-app = Flask(__name__)
-app.secret_key = 'your-secret-key-change-this'
+bp = Blueprint('messaging', __name__)
+
+IMAGE_CACHE_SECONDS = 365 * 24 * 3600
+MAX_BATCH_SIZE = 1000
+ENCRYPTED_PLACEHOLDER = "🎨 [Encrypted Sticker Message]"
 
 # Database setup
 def init_db():
-    conn = sqlite3.connect('messaging_app.db')
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            phone_number TEXT UNIQUE NOT NULL,
-            otp TEXT,
-            is_verified BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Contacts table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS contacts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            contact_phone TEXT,
-            contact_name TEXT,
-            status TEXT DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Messages table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender_id INTEGER,
-            receiver_phone TEXT,
-            message_text TEXT,
-            encrypted_image BLOB,
-            decrypt_code TEXT,
-            is_encrypted BOOLEAN DEFAULT FALSE,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            auto_delete_time TIMESTAMP DEFAULT NULL,
-            FOREIGN KEY (sender_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Check if auto_delete_time column exists, if not add it
-    cursor.execute("PRAGMA table_info(messages)")
-    columns = [column[1] for column in cursor.fetchall()]
-    
-    if 'auto_delete_time' not in columns:
-        print("Adding auto_delete_time column to messages table...")
-        cursor.execute('ALTER TABLE messages ADD COLUMN auto_delete_time TIMESTAMP DEFAULT NULL')
-        print("Column added successfully!")
-    
-    conn.commit()
-    conn.close()
+    with database.pool.connection() as conn:
+        database.schema_version = migrations.run_migrations(conn)
+        database.schema = migrations.load_schema(conn)
+    print(f"Database schema at version {database.schema_version}")
 
 # Utility functions
 def generate_otp():
@@ -79,240 +49,194 @@ def generate_decrypt_code():
     return ''.join(random.choices(string.ascii_letters + string.digits, k=8))
 
 def get_user_by_phone(phone_number):
-    conn = sqlite3.connect('messaging_app.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE phone_number = ?', (phone_number,))
-    user = cursor.fetchone()
-    conn.close()
-    return user
-
-def create_or_update_user(phone_number, otp):
-    conn = sqlite3.connect('messaging_app.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO users (phone_number, otp, is_verified)
-        VALUES (?, ?, FALSE)
-    ''', (phone_number, otp))
-    conn.commit()
-    conn.close()
+    return user_cache.get_user(phone_number)
 
 def verify_user(phone_number):
-    conn = sqlite3.connect('messaging_app.db')
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET is_verified = TRUE WHERE phone_number = ?', (phone_number,))
-    conn.commit()
-    conn.close()
-
-def get_all_available_stickers():
-    """Get all available sticker files from static/images folder"""
-    stickers_dir = os.path.join('static', 'images')
-    available_stickers = []
-    
-    try:
-        # Get all image files from the static/images folder
-        if os.path.exists(stickers_dir):
-            for file in os.listdir(stickers_dir):
-                if file.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-                    sticker_path = os.path.join(stickers_dir, file)
-                    available_stickers.append(sticker_path)
-                    
-        print(f"Found {len(available_stickers)} stickers in folder: {[os.path.basename(s) for s in available_stickers]}")
-        
-    except Exception as e:
-        print(f"Error reading stickers folder: {e}")
-    
-    return available_stickers
+    """Return the users row for a phone that just passed OTP verification, creating it if needed"""
+    user = user_cache.get_user(phone_number)
+    if user and user[3]:  # user[3] is is_verified; returning users cost no write
+        return user
+    # An upsert keeps the row and its id; REPLACE would delete and re-insert it
+    database.execute('''
+        INSERT INTO users (phone_number, is_verified) VALUES (?, TRUE)
+        ON CONFLICT (phone_number) DO UPDATE SET is_verified = TRUE
+    ''', (phone_number,))
+    user_cache.invalidate_user(phone_number)
+    return user_cache.get_user(phone_number)
 
-def get_random_sticker():
-    """Get a random sticker from available stickers in static/images folder"""
-    available_stickers = get_all_available_stickers()
-    
-    if available_stickers:
-        selected_sticker = random.choice(available_stickers)
-        print(f"Selected random sticker: {os.path.basename(selected_sticker)}")
-        return selected_sticker
-    else:
-        print("No stickers found in static/images folder!")
-        # Create a fallback sticker if no stickers found
-        create_fallback_sticker()
-        return os.path.join('static', 'images', 'fallback_sticker.png')
-
-def create_fallback_sticker():
-    """Create a simple fallback sticker if no stickers are found"""
-    stickers_dir = os.path.join('static', 'images')
-    os.makedirs(stickers_dir, exist_ok=True)
-    sticker_path = os.path.join(stickers_dir, 'fallback_sticker.png')
-    
-    # Create a simple colorful sticker
-    img = Image.new('RGB', (400, 300), (255, 255, 255))
-    draw = ImageDraw.Draw(img)
-    
-    # Draw a colorful background pattern
-    colors = [(255, 182, 193), (173, 216, 230), (144, 238, 144), (255, 218, 185), (221, 160, 221)]
-    for i in range(5):
-        color = colors[i]
-        draw.rectangle([i*80, 0, (i+1)*80, 300], fill=color)
-    
-    # Add some decorative elements
-    draw.ellipse([50, 50, 150, 150], fill=(255, 255, 0))
-    draw.ellipse([250, 150, 350, 250], fill=(255, 0, 255))
-    draw.rectangle([150, 200, 250, 250], fill=(0, 255, 255))
-    
-    # Add text
-    try:
-        font = ImageFont.truetype("arial.ttf", 20)
-    except:
-        font = ImageFont.load_default()
-    
-    draw.text((160, 120), "FALLBACK", fill=(0, 0, 0), font=font)
-    
-    img.save(sticker_path)
-    print(f"Created fallback sticker at {sticker_path}")
+_DELETABLE_MESSAGE_QUERY = '''
+    SELECT m.id, m.sender_id, m.receiver_phone, u.phone_number, m.image_key
+    FROM messages m
+    LEFT JOIN users u ON m.sender_id = u.id
+'''
 
-def text_to_image_steganography(text, decrypt_code, image_path=None):
-    """Convert text to steganography image using a random sticker as base"""
+def delete_message_rows(conn, rows):
+    """Delete (message_id, sender_id, receiver_phone, sender_phone, image_key) rows
+    and return the blob keys nothing references any more. The rows must have been
+    selected in conn's current write transaction (BEGIN IMMEDIATE), or another
+    worker may delete them first and their references get released twice"""
+    if not rows:
+        return []
+    # Leave a tombstone behind so syncing clients learn about the deletion
+    conn.executemany('''
+        INSERT INTO message_tombstones (message_id, sender_id, receiver_phone)
+        VALUES (?, ?, ?)
+    ''', [(r[0], r[1], r[2]) for r in rows])
+    conn.executemany('DELETE FROM messages WHERE id = ?', [(r[0],) for r in rows])
+    conversations.remove_messages(conn, [(r[0], r[3], r[2]) for r in rows])
+    conn.executemany('DELETE FROM decrypt_attempts WHERE message_id = ?', [(r[0],) for r in rows])
+    conn.executemany('DELETE FROM message_updates WHERE message_id = ?', [(r[0],) for r in rows])
+    return blob_store.store.release(conn, [r[4] for r in rows])
+
+def cleanup_expired_messages():
+    """Delete messages that have expired auto-delete time"""
     try:
-        # Get a random sticker as base image
-        sticker_path = get_random_sticker()
-        
-        base_img = Image.open(sticker_path).copy()
-        print(f"Using random sticker base image: {sticker_path}")
-        
-        # Resize if too large
-        if base_img.size[0] > 400 or base_img.size[1] > 300:
-            base_img = base_img.resize((400, 300), Image.Resampling.LANCZOS)
-        
-        # Add some random decorative elements to make it look more natural
-        draw = ImageDraw.Draw(base_img)
-        
-        # Add subtle random elements for camouflage
-        for _ in range(random.randint(1, 3)):
-            shape_type = random.choice(['circle', 'rectangle'])
-            color = tuple(random.randint(200, 255) for _ in range(3))  # Light colors
-            alpha = random.randint(30, 80)  # Low opacity
+        if not database.has_column('messages', 'auto_delete_time'):
+            print("auto_delete_time column not found, skipping cleanup")
+            return
+        
+        current_time = datetime.now().isoformat()
+        with metrics.timer('cleanup_seconds'), database.pool.connection() as conn:
+            # Take the write lock before selecting, so workers whose timers fire
+            # together run one after another and only the first sees the rows
+            conn.execute('BEGIN IMMEDIATE')
+            expired = conn.execute(_DELETABLE_MESSAGE_QUERY + '''
+                WHERE m.auto_delete_time IS NOT NULL 
+                AND m.auto_delete_time <= ?
+            ''', (current_time,)).fetchall()
             
-            if shape_type == 'circle':
-                x, y = random.randint(0, 350), random.randint(0, 250)
-                r = random.randint(5, 15)
-                # Create a semi-transparent overlay
-                overlay = Image.new('RGBA', base_img.size, (0, 0, 0, 0))
-                overlay_draw = ImageDraw.Draw(overlay)
-                overlay_draw.ellipse([x, y, x+r, y+r], fill=(*color, alpha))
-                base_img = Image.alpha_composite(base_img.convert('RGBA'), overlay).convert('RGB')
-        
-        # Hide the actual message and decrypt code in image metadata
-        message_data = {
-            'message': text,
-            'decrypt_code': decrypt_code,
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        # Convert to base64 and hide in image
-        encoded_data = base64.b64encode(json.dumps(message_data).encode()).decode()
-        
-        # Create PngInfo object for metadata
-        pnginfo = PngInfo()
-        pnginfo.add_text("hidden_message", encoded_data)
-        pnginfo.add_text("sticker_type", "encrypted_sticker")
-        
-        # Save to bytes with proper PNG info
-        img_buffer = io.BytesIO()
-        base_img.save(img_buffer, format='PNG', pnginfo=pnginfo)
-        img_buffer.seek(0)
-        
-        return img_buffer.getvalue()
+            orphaned_blobs = delete_message_rows(conn, expired)
         
+        if expired:
+            blob_store.store.remove_files(orphaned_blobs)
+            metrics.inc('expired_messages_deleted_total', len(expired))
+            print(f"Cleaned up {len(expired)} expired messages")
+            publish_deleted_messages(expired)
     except Exception as e:
-        print(f"Error in text_to_image_steganography: {e}")
-        # Fallback: create simple image
-        base_img = Image.new('RGB', (400, 300), (255, 182, 193))
-        draw = ImageDraw.Draw(base_img)
-        
-        try:
-            font = ImageFont.truetype("arial.ttf", 16)
-        except:
-            font = ImageFont.load_default()
-            
-        draw.text((50, 150), "Encrypted Sticker Message", fill=(0, 0, 0), font=font)
-        
-        img_buffer = io.BytesIO()
-        base_img.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
-        
-        return img_buffer.getvalue()
+        print(f"Error in cleanup_expired_messages: {e}")
+
+def publish_new_message(message):
+    """Push a freshly stored message to both ends of the conversation"""
+    sender_phone, receiver_phone = message[1], message[2]
+    events.hub.publish(receiver_phone, 'message', serialize_message(message, receiver_phone))
+    if sender_phone != receiver_phone:
+        events.hub.publish(sender_phone, 'message', serialize_message(message, sender_phone))
+
+def publish_updated_message(message):
+    sender_phone, receiver_phone = message[1], message[2]
+    events.hub.publish(receiver_phone, 'updated', serialize_message(message, receiver_phone))
+    if sender_phone != receiver_phone:
+        events.hub.publish(sender_phone, 'updated', serialize_message(message, sender_phone))
+
+def publish_deleted_messages(deleted):
+    """deleted holds (message_id, sender_id, receiver_phone, sender_phone, ...) rows"""
+    ids_by_phone = {}
+    for message_id, _, receiver_phone, sender_phone, *_ in deleted:
+        for phone in {receiver_phone, sender_phone}:
+            if phone:
+                ids_by_phone.setdefault(phone, []).append(message_id)
+    for phone, message_ids in ids_by_phone.items():
+        events.hub.publish(phone, 'deleted', message_ids)
 
-def extract_from_steganography(image_data, provided_code):
-    """Extract hidden message from steganography image"""
+def serialize_message(m, user_phone):
+    return {
+        'id': m[0],
+        'sender': m[1],
+        'receiver': m[2],
+        'message': m[3],
+        'is_encrypted': m[4],
+        'timestamp': m[5],
+        'decrypt_code': m[6] if m[1] == user_phone else None,  # Only show decrypt code to sender
+        'auto_delete_time': m[7],
+        'pending': bool(m[4]) and not m[8]  # encrypted sticker still being rendered
+    }
+
+def discard_unrendered_message(message_id):
+    """Delete an async message whose sticker could not be rendered, so it isn't pending forever"""
+    with database.pool.connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')  # see cleanup_expired_messages
+        rows = conn.execute(_DELETABLE_MESSAGE_QUERY + '''
+            WHERE m.id = ? AND m.image_key IS NULL
+        ''', (message_id,)).fetchall()
+        delete_message_rows(conn, rows)
+    if rows:
+        metrics.inc('failed_renders_discarded_total')
+        publish_deleted_messages(rows)
+
+def attach_rendered_image(message_id, future):
+    """Fill in the sticker of a message sent in async mode once its render finishes"""
     try:
-        img_buffer = io.BytesIO(image_data)
-        img = Image.open(img_buffer)
-        
-        # Try to get the hidden message from text metadata
-        if hasattr(img, 'text') and 'hidden_message' in img.text:
-            encoded_data = img.text['hidden_message']
-            decoded_data = base64.b64decode(encoded_data).decode()
-            message_data = json.loads(decoded_data)
-            
-            # Verify decrypt code
-            if message_data['decrypt_code'] == provided_code:
-                return message_data['message']
-            else:
-                return None
-                
-        # Fallback: check info attribute (older method)
-        elif hasattr(img, 'info') and 'hidden_message' in img.info:
-            encoded_data = img.info['hidden_message']
-            decoded_data = base64.b64decode(encoded_data).decode()
-            message_data = json.loads(decoded_data)
-            
-            # Verify decrypt code
-            if message_data['decrypt_code'] == provided_code:
-                return message_data['message']
-            else:
-                return None
-                
-        return None
-        
+        try:
+            image = future.result()
+        except Exception as e:
+            print(f"Render for message {message_id} failed: {e}")
+            discard_unrendered_message(message_id)
+            return
+        
+        image_key, image_size = blob_store.store.write(image)
+        with database.pool.connection() as conn:
+            cursor = conn.execute('''
+                UPDATE messages SET image_key = ?, image_size = ?
+                WHERE id = ? AND image_key IS NULL
+            ''', (image_key, image_size, message_id))
+            if cursor.rowcount:
+                blob_store.store.add_reference(conn, image_key, image_size)
+                # Clients that missed the 'updated' event pick the sticker up on their next /sync
+                conn.execute('''
+                    INSERT INTO message_updates (message_id, sender_id, receiver_phone)
+                    SELECT id, sender_id, receiver_phone FROM messages WHERE id = ?
+                ''', (message_id,))
+        
+        if not cursor.rowcount:
+            # Message was auto-deleted before its sticker was ready
+            if not database.query_one('SELECT 1 FROM blobs WHERE key = ?', (image_key,)):
+                blob_store.store.remove_files([image_key])
+            return
+        
+        message = timeline.fetch_message(message_id)
+        if message:
+            publish_updated_message(message)
     except Exception as e:
-        print(f"Decryption error: {e}")
+        print(f"Error attaching rendered image to message {message_id}: {e}")
+
+expiry_scheduler = expiry.ExpiryScheduler(cleanup_expired_messages)
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@bp.before_app_request
+def enforce_rate_limits():
+    endpoint = (request.endpoint or '').rpartition('.')[2]
+    if endpoint not in rate_limit.costs:
         return None
+    data = request.get_json(silent=True)
+    client_key = f"user:{session['user_id']}" if 'user_id' in session else f'ip:{request.remote_addr}'
+    retry_after = rate_limit.check(endpoint, client_key, data if isinstance(data, dict) else {})
+    if retry_after:
+        metrics.inc('rate_limited_total', endpoint=endpoint)
+        return jsonify({'success': False, 'message': f'Too many requests, please retry in {retry_after} seconds'}), 429, {
+            'Retry-After': str(retry_after)
+        }
+    return None
 
-def cleanup_expired_messages():
-    """Delete messages that have expired auto-delete time"""
-    try:
-        conn = sqlite3.connect('messaging_app.db')
-        cursor = conn.cursor()
-        
-        # Check if column exists before trying to use it
-        cursor.execute("PRAGMA table_info(messages)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'auto_delete_time' in columns:
-            current_time = datetime.now().isoformat()
-            cursor.execute('''
-                DELETE FROM messages 
-                WHERE auto_delete_time IS NOT NULL 
-                AND auto_delete_time <= ?
-            ''', (current_time,))
-            deleted_count = cursor.rowcount
-            conn.commit()
-            if deleted_count > 0:
-                print(f"Cleaned up {deleted_count} expired messages")
-        else:
-            print("auto_delete_time column not found, skipping cleanup")
-            
-        conn.close()
-    except Exception as e:
-        print(f"Error in cleanup_expired_messages: {e}")
+@bp.after_app_request
+def record_request_metrics(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        endpoint = request.endpoint or 'unmatched'
+        metrics.observe('http_request_seconds', time.perf_counter() - start, endpoint=endpoint)
+        metrics.inc('http_requests_total', endpoint=endpoint, status=response.status_code)
+    return response
 
 # Routes
-@app.route('/')
+@bp.route('/')
 def index():
     if 'user_phone' in session:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('.dashboard'))
     return render_template('login.html')
 
-@app.route('/send_otp', methods=['POST'])
+@bp.route('/send_otp', methods=['POST'])
 def send_otp():
     try:
         data = request.get_json()
@@ -324,7 +248,7 @@ def send_otp():
             return jsonify({'success': False, 'message': 'Phone number required'})
         
         otp = generate_otp()
-        create_or_update_user(phone_number, otp)
+        otp_store.store.issue(phone_number, otp)
         
         # In real app, send OTP via SMS API
         # For demo, we'll return the OTP (remove in production)
@@ -338,7 +262,7 @@ def send_otp():
         print(f"Error in send_otp: {e}")
         return jsonify({'success': False, 'message': 'Server error occurred'})
 
-@app.route('/verify_otp', methods=['POST'])
+@bp.route('/verify_otp', methods=['POST'])
 def verify_otp():
     try:
         data = request.get_json()
@@ -351,12 +275,17 @@ def verify_otp():
         if not phone_number or not otp:
             return jsonify({'success': False, 'message': 'Phone number and OTP required'})
         
-        user = get_user_by_phone(phone_number)
-        if user and user[2] == otp:  # user[2] is otp column
-            verify_user(phone_number)
+        result = otp_store.store.verify(phone_number, otp)
+        metrics.inc('otp_verifications_total', result=result)
+        if result == otp_store.VERIFIED:
+            user = verify_user(phone_number)
             session['user_phone'] = phone_number
             session['user_id'] = user[0]
             return jsonify({'success': True, 'message': 'Login successful'})
+        if result == otp_store.EXPIRED:
+            return jsonify({'success': False, 'message': 'OTP expired, please request a new one'})
+        if result == otp_store.LOCKED:
+            return jsonify({'success': False, 'message': 'Too many wrong attempts, please request a new OTP'})
         
         return jsonify({'success': False, 'message': 'Invalid OTP'})
         
@@ -364,13 +293,13 @@ def verify_otp():
         print(f"Error in verify_otp: {e}")
         return jsonify({'success': False, 'message': 'Server error occurred'})
 
-@app.route('/dashboard')
+@bp.route('/dashboard')
 def dashboard():
     if 'user_phone' not in session:
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     return render_template('dashboard.html')
 
-@app.route('/add_contact', methods=['POST'])
+@bp.route('/add_contact', methods=['POST'])
 def add_contact():
     try:
         if 'user_id' not in session:
@@ -386,14 +315,11 @@ def add_contact():
         if not contact_phone:
             return jsonify({'success': False, 'message': 'Contact phone required'})
         
-        conn = sqlite3.connect('messaging_app.db')
-        cursor = conn.cursor()
-        cursor.execute('''
+        database.execute('''
             INSERT INTO contacts (user_id, contact_phone, contact_name)
             VALUES (?, ?, ?)
         ''', (session['user_id'], contact_phone, contact_name))
-        conn.commit()
-        conn.close()
+        user_cache.invalidate_contacts(session['user_id'])
         
         return jsonify({'success': True, 'message': 'Contact added successfully'})
         
@@ -401,20 +327,13 @@ def add_contact():
         print(f"Error in add_contact: {e}")
         return jsonify({'success': False, 'message': 'Server error occurred'})
 
-@app.route('/get_contacts')
+@bp.route('/get_contacts')
 def get_contacts():
     try:
         if 'user_id' not in session:
             return jsonify([])
         
-        conn = sqlite3.connect('messaging_app.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT contact_phone, contact_name FROM contacts 
-            WHERE user_id = ?
-        ''', (session['user_id'],))
-        contacts = cursor.fetchall()
-        conn.close()
+        contacts = user_cache.get_contacts(session['user_id'])
         
         return jsonify([{'phone': c[0], 'name': c[1]} for c in contacts])
         
@@ -422,7 +341,101 @@ def get_contacts():
         print(f"Error in get_contacts: {e}")
         return jsonify([])
 
-@app.route('/send_message', methods=['POST'])
+def serialize_conversation(phone, name, summary=None):
+    last_message_id, last_timestamp, preview, unread_count, auto_delete_time = summary or (None, None, None, 0, None)
+    return {
+        'phone': phone,
+        'name': name,
+        'last_message_id': last_message_id,
+        'last_timestamp': last_timestamp,
+        'preview': preview,
+        'unread_count': unread_count,
+        'auto_delete_time': auto_delete_time
+    }
+
+@bp.route('/get_conversations')
+def get_conversations():
+    """The whole sidebar: conversations newest first, then contacts with no messages yet"""
+    try:
+        if 'user_id' not in session:
+            return jsonify([])
+        
+        names = {phone: name for phone, name in user_cache.get_contacts(session['user_id'])}
+        sidebar = [serialize_conversation(peer, names.pop(peer, peer), summary)
+                   for peer, *summary in conversations.fetch_sidebar(session['user_phone'])]
+        sidebar.extend(serialize_conversation(phone, name) for phone, name in names.items())
+        
+        return jsonify(sidebar)
+        
+    except Exception as e:
+        print(f"Error in get_conversations: {e}")
+        return jsonify([])
+
+@bp.route('/mark_conversation_read', methods=['POST'])
+def mark_conversation_read():
+    try:
+        if 'user_id' not in session:
+            return jsonify({'success': False, 'message': 'Not logged in'})
+        
+        data = request.get_json()
+        if not data or not data.get('peer_phone'):
+            return jsonify({'success': False, 'message': 'Peer phone required'})
+        
+        conversations.mark_read(session['user_phone'], data['peer_phone'])
+        return jsonify({'success': True})
+        
+    except Exception as e:
+        print(f"Error in mark_conversation_read: {e}")
+        return jsonify({'success': False, 'message': 'Server error occurred'})
+
+def payload_mode_error(message_text, payload_mode):
+    """Return why an encrypted message can't use payload_mode, or None if it can"""
+    if payload_mode not in PAYLOAD_MODES:
+        return f'Payload mode must be one of {", ".join(PAYLOAD_MODES)}'
+    if payload_mode == 'lsb':
+        if not lsb.available():
+            return 'Pixel payload mode needs NumPy installed'
+        # The render picks a sticker at random, so the payload must fit the smallest one
+        if payload_size(message_text, generate_decrypt_code()) > lsb.capacity(stickers.pool.smallest_size()):
+            return 'Message too long to hide in a sticker'
+    return None
+
+def render_busy_response():
+    return jsonify({'success': False, 'message': 'Server busy, please retry shortly'}), 503, {
+        'Retry-After': str(render_pool.RETRY_AFTER_SECONDS)
+    }
+
+def store_messages(sender_id, sender_phone, rows):
+    """Insert (receiver_phone, message_text, image_key, image_size, decrypt_code, is_encrypted)
+    rows atomically through the write queue, push them to subscribers and return their ids"""
+    image_refs = {}
+    for _, _, image_key, image_size, _, _ in rows:
+        if image_key:
+            count = image_refs.get(image_key, (image_size, 0))[1]
+            image_refs[image_key] = (image_size, count + 1)
+    
+    params = [(sender_id, *row, decrypt_codes.hash_code(row[4]) if row[4] else None) for row in rows]
+    
+    def insert(conn):
+        for image_key, (image_size, count) in image_refs.items():
+            blob_store.store.add_reference(conn, image_key, image_size, count)
+        conn.executemany('''
+            INSERT INTO messages (sender_id, receiver_phone, message_text, image_key, image_size, decrypt_code, is_encrypted,
+                                  decrypt_code_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', params)
+        # One writer holds the lock for the whole transaction, so the new ids are contiguous
+        last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+        conversations.record_messages(conn, sender_phone, last_id - len(rows) + 1, last_id)
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+    
+    # Committed together with other requests' inserts; returns once ours are durable
+    message_ids = write_queue.writer.execute(insert, len(rows))
+    for message in timeline.fetch_message_range(message_ids[0], message_ids[-1]):
+        publish_new_message(message)
+    return message_ids
+
+@bp.route('/send_message', methods=['POST'])
 def send_message():
     try:
         if 'user_id' not in session:
@@ -439,28 +452,43 @@ def send_message():
         if not receiver_phone or not message_text:
             return jsonify({'success': False, 'message': 'Receiver phone and message text required'})
         
-        encrypted_image = None
+        render_async = bool(data.get('async', render_pool.RENDER_ASYNC))
+        payload_mode = data.get('payload_mode', DEFAULT_PAYLOAD_MODE)
+        image_key = None
+        image_size = None
         decrypt_code = None
+        render = None
         
         if is_encrypted:
+            error = payload_mode_error(message_text, payload_mode)
+            if error:
+                return jsonify({'success': False, 'message': error})
+            
             decrypt_code = generate_decrypt_code()
-            # Create steganography image using a random sticker as base
-            encrypted_image = text_to_image_steganography(message_text, decrypt_code)
-            message_text = "🎨 [Encrypted Sticker Message]"
-        
-        conn = sqlite3.connect('messaging_app.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO messages (sender_id, receiver_phone, message_text, encrypted_image, decrypt_code, is_encrypted)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (session['user_id'], receiver_phone, message_text, encrypted_image, decrypt_code, is_encrypted))
-        conn.commit()
-        conn.close()
-        
-        response = {'success': True, 'message': 'Message sent successfully'}
+            # Create steganography image using a random sticker as base, off the request thread
+            try:
+                render = render_pool.pool.submit(message_text, decrypt_code, mode=payload_mode)
+            except render_pool.RenderPoolBusy:
+                return render_busy_response()
+            if not render_async:
+                try:
+                    image_key, image_size = blob_store.store.write(render.result())
+                except lsb.PayloadTooLarge:
+                    return jsonify({'success': False, 'message': 'Message too long to hide in this sticker'})
+            message_text = ENCRYPTED_PLACEHOLDER
+            metrics.inc('encrypted_sends_total', mode=payload_mode)
+        
+        message_id, = store_messages(session['user_id'], session['user_phone'], [
+            (receiver_phone, message_text, image_key, image_size, decrypt_code, is_encrypted)
+        ])
+        
+        response = {'success': True, 'message': 'Message sent successfully', 'message_id': message_id}
         if is_encrypted:
             response['decrypt_code'] = decrypt_code
             response['message'] = 'Encrypted sticker message sent! Share the decrypt code with recipient.'
+            if render_async:
+                response['pending'] = True
+                render_pool.pool.add_done_callback(render, lambda done: attach_rendered_image(message_id, done))
         
         return jsonify(response)
         
@@ -468,83 +496,255 @@ def send_message():
         print(f"Error in send_message: {e}")
         return jsonify({'success': False, 'message': 'Server error occurred'})
 
-@app.route('/get_messages')
+@bp.route('/send_messages', methods=['POST'])
+def send_messages():
+    """Batch send in one request and one transaction.
+
+    Either a broadcast: {receiver_phones: [...], message_text, is_encrypted, payload_mode}
+    where an encrypted sticker is rendered and stored once for every recipient,
+    or a list: {messages: [{receiver_phone, message_text, is_encrypted, payload_mode}, ...]}.
+    """
+    try:
+        if 'user_id' not in session:
+            return jsonify({'success': False, 'message': 'Not logged in'})
+        
+        data = request.get_json()
+        if not data:
+            return jsonify({'success': False, 'message': 'Invalid request format'})
+        
+        if 'receiver_phones' in data:
+            receiver_phones = data.get('receiver_phones')
+            message_text = data.get('message_text')
+            is_encrypted = data.get('is_encrypted', False)
+            payload_mode = data.get('payload_mode', DEFAULT_PAYLOAD_MODE)
+            
+            if not isinstance(receiver_phones, list) or not receiver_phones or not all(receiver_phones) or not message_text:
+                return jsonify({'success': False, 'message': 'Receiver phones and message text required'})
+            if len(receiver_phones) > MAX_BATCH_SIZE:
+                return jsonify({'success': False, 'message': f'At most {MAX_BATCH_SIZE} messages per batch'})
+            
+            image_key = None
+            image_size = None
+            decrypt_code = None
+            
+            if is_encrypted:
+                error = payload_mode_error(message_text, payload_mode)
+                if error:
+                    return jsonify({'success': False, 'message': error})
+                
+                # One sticker and one decrypt code shared by every recipient
+                decrypt_code = generate_decrypt_code()
+                try:
+                    image = render_pool.pool.render(message_text, decrypt_code, mode=payload_mode)
+                except render_pool.RenderPoolBusy:
+                    return render_busy_response()
+                except lsb.PayloadTooLarge:
+                    return jsonify({'success': False, 'message': 'Message too long to hide in this sticker'})
+                image_key, image_size = blob_store.store.write(image)
+                message_text = ENCRYPTED_PLACEHOLDER
+                metrics.inc('encrypted_sends_total', len(receiver_phones), mode=payload_mode)
+            
+            message_ids = store_messages(session['user_id'], session['user_phone'], [
+                (phone, message_text, image_key, image_size, decrypt_code, is_encrypted)
+                for phone in receiver_phones
+            ])
+            
+            response = {'success': True, 'message': f'{len(message_ids)} messages sent', 'message_ids': message_ids}
+            if is_encrypted:
+                response['decrypt_code'] = decrypt_code
+            return jsonify(response)
+        
+        items = data.get('messages')
+        if not isinstance(items, list) or not items:
+            return jsonify({'success': False, 'message': 'receiver_phones or messages required'})
+        if len(items) > MAX_BATCH_SIZE:
+            return jsonify({'success': False, 'message': f'At most {MAX_BATCH_SIZE} messages per batch'})
+        
+        for item in items:
+            if not isinstance(item, dict) or not item.get('receiver_phone') or not item.get('message_text'):
+                return jsonify({'success': False, 'message': 'Every message needs a receiver phone and message text'})
+            if item.get('is_encrypted'):
+                error = payload_mode_error(item['message_text'], item.get('payload_mode', DEFAULT_PAYLOAD_MODE))
+                if error:
+                    return jsonify({'success': False, 'message': error})
+        
+        # Every render of the batch is queued at once, so more than the queue
+        # holds could never be accepted, however idle the server is
+        encrypted_count = sum(1 for item in items if item.get('is_encrypted'))
+        if encrypted_count > render_pool.pool.queue_limit:
+            return jsonify({'success': False,
+                            'message': f'At most {render_pool.pool.queue_limit} encrypted messages per batch'})
+        
+        # Queue every render first so the worker processes work on them in parallel
+        codes = []
+        renders = []
+        try:
+            for item in items:
+                if item.get('is_encrypted'):
+                    decrypt_code = generate_decrypt_code()
+                    renders.append(render_pool.pool.submit(item['message_text'], decrypt_code,
+                                                           mode=item.get('payload_mode', DEFAULT_PAYLOAD_MODE)))
+                else:
+                    decrypt_code = None
+                    renders.append(None)
+                codes.append(decrypt_code)
+            
+            rows = []
+            for item, decrypt_code, render in zip(items, codes, renders):
+                if render is None:
+                    rows.append((item['receiver_phone'], item['message_text'], None, None, None, False))
+                    continue
+                image_key, image_size = blob_store.store.write(render.result())
+                rows.append((item['receiver_phone'], ENCRYPTED_PLACEHOLDER, image_key, image_size, decrypt_code, True))
+                metrics.inc('encrypted_sends_total', mode=item.get('payload_mode', DEFAULT_PAYLOAD_MODE))
+        except render_pool.RenderPoolBusy:
+            return render_busy_response()
+        except lsb.PayloadTooLarge:
+            return jsonify({'success': False, 'message': 'Message too long to hide in this sticker'})
+        finally:
+            # Nothing is stored when the batch bails out; don't keep rendering for it
+            for render in renders:
+                if render is not None:
+                    render.cancel()
+        
+        message_ids = store_messages(session['user_id'], session['user_phone'], rows)
+        return jsonify({
+            'success': True,
+            'message': f'{len(message_ids)} messages sent',
+            'message_ids': message_ids,
+            'decrypt_codes': codes
+        })
+        
+    except Exception as e:
+        print(f"Error in send_messages: {e}")
+        return jsonify({'success': False, 'message': 'Server error occurred'})
+
+@bp.route('/get_messages')
 def get_messages():
     try:
         if 'user_phone' not in session:
             return jsonify([])
         
-        # Clean up expired messages first
-        cleanup_expired_messages()
+        # Get messages where user is sender or receiver
+        messages = timeline.fetch_page(session['user_id'], session['user_phone'], limit=-1)
+        
+        return jsonify([serialize_message(m, session['user_phone']) for m in messages])
+        
+    except Exception as e:
+        print(f"Error in get_messages: {e}")
+        return jsonify([])
+
+@bp.route('/get_timeline')
+def get_timeline():
+    """Page through a user's messages using before_id / after_id cursors"""
+    try:
+        if 'user_phone' not in session:
+            return jsonify({'success': False, 'message': 'Not logged in'})
+        
+        before_id = request.args.get('before_id', type=int)
+        after_id = request.args.get('after_id', type=int)
+        limit = timeline.clamp_page_size(request.args.get('limit', timeline.DEFAULT_PAGE_SIZE))
         
-        conn = sqlite3.connect('messaging_app.db')
-        cursor = conn.cursor()
+        if before_id is not None and after_id is not None:
+            return jsonify({'success': False, 'message': 'Use either before_id or after_id, not both'})
         
-        # Check if auto_delete_time column exists
-        cursor.execute("PRAGMA table_info(messages)")
-        columns = [column[1] for column in cursor.fetchall()]
+        messages = timeline.fetch_page(session['user_id'], session['user_phone'],
+                                       before_id=before_id, after_id=after_id, limit=limit)
         
-        if 'auto_delete_time' in columns:
-            # Get messages where user is sender or receiver (with auto_delete_time)
-            cursor.execute('''
-                SELECT m.id, u.phone_number as sender_phone, m.receiver_phone, 
-                       m.message_text, m.is_encrypted, m.timestamp, m.decrypt_code, m.auto_delete_time
-                FROM messages m
-                JOIN users u ON m.sender_id = u.id
-                WHERE m.receiver_phone = ? OR u.phone_number = ?
-                ORDER BY m.timestamp DESC
-            ''', (session['user_phone'], session['user_phone']))
+        return jsonify({
+            'success': True,
+            'messages': [serialize_message(m, session['user_phone']) for m in messages],
+            'has_more': len(messages) == limit,
+            'oldest_id': messages[-1][0] if messages else None,
+            'newest_id': messages[0][0] if messages else None
+        })
+        
+    except Exception as e:
+        print(f"Error in get_timeline: {e}")
+        return jsonify({'success': False, 'message': 'Server error occurred'})
+
+@bp.route('/sync')
+def sync_messages():
+    """Return only what changed since the client's cursor: new, updated and deleted messages"""
+    try:
+        if 'user_phone' not in session:
+            return jsonify({'success': False, 'message': 'Not logged in'})
+        
+        position = timeline.decode_cursor(request.args.get('cursor'))
+        if position:
+            since_id, since_tombstone_id, since_update_id = position
         else:
-            # Get messages where user is sender or receiver (without auto_delete_time)
-            cursor.execute('''
-                SELECT m.id, u.phone_number as sender_phone, m.receiver_phone, 
-                       m.message_text, m.is_encrypted, m.timestamp, m.decrypt_code, NULL
-                FROM messages m
-                JOIN users u ON m.sender_id = u.id
-                WHERE m.receiver_phone = ? OR u.phone_number = ?
-                ORDER BY m.timestamp DESC
-            ''', (session['user_phone'], session['user_phone']))
-        
-        messages = cursor.fetchall()
-        conn.close()
-        
-        return jsonify([{
-            'id': m[0],
-            'sender': m[1],
-            'receiver': m[2],
-            'message': m[3],
-            'is_encrypted': m[4],
-            'timestamp': m[5],
-            'decrypt_code': m[6] if m[1] == session['user_phone'] else None,  # Only show decrypt code to sender
-            'auto_delete_time': m[7] if len(m) > 7 else None
-        } for m in messages])
+            # First sync: everything after since_id, and no deletions or updates the client never saw
+            since_id = request.args.get('since_id', 0, type=int)
+            since_tombstone_id = timeline.latest_tombstone_id()
+            since_update_id = timeline.latest_update_id()
+        
+        messages = timeline.fetch_page(session['user_id'], session['user_phone'],
+                                       after_id=since_id, limit=timeline.MAX_PAGE_SIZE)
+        tombstones = timeline.fetch_tombstones(session['user_id'], session['user_phone'], since_tombstone_id)
+        since_update_id, updated = timeline.fetch_updates(session['user_id'], session['user_phone'], since_update_id)
+        
+        if messages:
+            since_id = messages[0][0]
+        if tombstones:
+            since_tombstone_id = tombstones[-1][0]
+        
+        return jsonify({
+            'success': True,
+            'messages': [serialize_message(m, session['user_phone']) for m in messages],
+            'updated': [serialize_message(m, session['user_phone']) for m in updated],
+            'deleted': [t[1] for t in tombstones],
+            'has_more': len(messages) == timeline.MAX_PAGE_SIZE,
+            'cursor': timeline.encode_cursor(since_id, since_tombstone_id, since_update_id)
+        })
         
     except Exception as e:
-        print(f"Error in get_messages: {e}")
-        return jsonify([])
+        print(f"Error in sync_messages: {e}")
+        return jsonify({'success': False, 'message': 'Server error occurred'})
+
+@bp.route('/stream')
+def stream():
+    """Server-Sent Events channel pushing new messages and auto-deletes as they happen"""
+    if 'user_phone' not in session:
+        return "Unauthorized", 401
+    
+    subscription = events.hub.subscribe(session['user_phone'])
+    return Response(events.stream(subscription), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # keep reverse proxies from buffering the stream
+    })
 
-@app.route('/get_encrypted_image/<int:message_id>')
+@bp.route('/get_encrypted_image/<int:message_id>')
 def get_encrypted_image(message_id):
     try:
         if 'user_id' not in session:
             return "Unauthorized", 401
         
-        conn = sqlite3.connect('messaging_app.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT encrypted_image FROM messages WHERE id = ?', (message_id,))
-        result = cursor.fetchone()
-        conn.close()
+        result = database.query_one('SELECT image_key FROM messages WHERE id = ?', (message_id,))
         
-        if result and result[0]:
-            return result[0], 200, {'Content-Type': 'image/png'}
+        if not result or not result[0] or not blob_store.store.exists(result[0]):
+            return "Image not found", 404
         
-        return "Image not found", 404
+        # Blobs are content-addressed, so the key is a strong ETag and the bytes never change.
+        # conditional=True answers If-None-Match with 304 and serves Range requests,
+        # and the file is streamed (sendfile where available) instead of read into memory.
+        response = send_file(
+            os.path.abspath(blob_store.store.path_for(result[0])),
+            mimetype='image/png',
+            etag=result[0],
+            conditional=True,
+            max_age=IMAGE_CACHE_SECONDS
+        )
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.immutable = True
+        return response
         
     except Exception as e:
         print(f"Error in get_encrypted_image: {e}")
         return "Server error", 500
 
-@app.route('/decrypt_message', methods=['POST'])
+@bp.route('/decrypt_message', methods=['POST'])
 def decrypt_message():
     try:
         if 'user_id' not in session:
@@ -560,21 +760,35 @@ def decrypt_message():
         if not message_id or not decrypt_code:
             return jsonify({'success': False, 'message': 'Message ID and decrypt code required'})
         
-        conn = sqlite3.connect('messaging_app.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT encrypted_image FROM messages WHERE id = ?', (message_id,))
-        result = cursor.fetchone()
-        conn.close()
+        # One primary-key lookup decides most requests; the sticker is only read for a matching code
+        result = database.query_one('''
+            SELECT m.image_key, m.decrypt_code_hash, a.failures FROM messages m
+            LEFT JOIN decrypt_attempts a ON a.message_id = m.id AND a.user_id = ?
+            WHERE m.id = ?
+        ''', (session['user_id'], message_id))
         
         if result and result[0]:
-            decrypted_message = extract_from_steganography(result[0], decrypt_code)
+            image_key, code_hash, failures = result
+            if (failures or 0) >= decrypt_codes.MAX_FAILED_ATTEMPTS:
+                metrics.inc('decrypt_failure_total', reason='locked')
+                return jsonify({'success': False, 'message': 'Too many wrong codes for this message'})
+            
+            if code_hash is not None and not decrypt_codes.matches(decrypt_code, code_hash):
+                with database.pool.connection() as conn:
+                    decrypt_codes.record_failure(conn, message_id, session['user_id'])
+                metrics.inc('decrypt_failure_total', reason='wrong_code')
+                return jsonify({'success': False, 'message': 'Invalid decrypt code'})
+            
+            decrypted_message = extract_from_steganography(blob_store.store.read(image_key), decrypt_code)
             if decrypted_message:
+                metrics.inc('decrypt_success_total')
                 return jsonify({
                     'success': True, 
                     'message': decrypted_message,
                     'show_auto_delete': True  # Show auto-delete option after successful decrypt
                 })
             else:
+                metrics.inc('decrypt_failure_total', reason='payload')
                 return jsonify({'success': False, 'message': 'Invalid decrypt code'})
         
         return jsonify({'success': False, 'message': 'Message not found'})
@@ -583,7 +797,7 @@ def decrypt_message():
         print(f"Error in decrypt_message: {e}")
         return jsonify({'success': False, 'message': 'Server error occurred'})
 
-@app.route('/set_auto_delete', methods=['POST'])
+@bp.route('/set_auto_delete', methods=['POST'])
 def set_auto_delete():
     """Set auto-delete timer for a message (15 seconds from now)"""
     try:
@@ -599,28 +813,28 @@ def set_auto_delete():
         if not message_id:
             return jsonify({'success': False, 'message': 'Message ID required'})
         
-        conn = sqlite3.connect('messaging_app.db')
-        cursor = conn.cursor()
-        
-        # Check if auto_delete_time column exists
-        cursor.execute("PRAGMA table_info(messages)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'auto_delete_time' not in columns:
-            conn.close()
+        if not database.has_column('messages', 'auto_delete_time'):
             return jsonify({'success': False, 'message': 'Auto-delete feature not available'})
         
         # Set auto-delete time to 15 seconds from now
         from datetime import timedelta
         delete_time = (datetime.now() + timedelta(seconds=15)).isoformat()
         
-        cursor.execute('''
-            UPDATE messages 
-            SET auto_delete_time = ? 
-            WHERE id = ?
-        ''', (delete_time, message_id))
-        conn.commit()
-        conn.close()
+        with database.pool.connection() as conn:
+            conn.execute('''
+                UPDATE messages 
+                SET auto_delete_time = ? 
+                WHERE id = ?
+            ''', (delete_time, message_id))
+            message = conn.execute('''
+                SELECT u.phone_number, m.receiver_phone FROM messages m
+                JOIN users u ON m.sender_id = u.id
+                WHERE m.id = ?
+            ''', (message_id,)).fetchone()
+            if message:
+                conversations.schedule_deletion(conn, message_id, *message, delete_time)
+        
+        expiry_scheduler.schedule(message_id, delete_time)
         
         return jsonify({
             'success': True, 
@@ -632,7 +846,7 @@ def set_auto_delete():
         print(f"Error in set_auto_delete: {e}")
         return jsonify({'success': False, 'message': 'Server error occurred'})
 
-@app.route('/copy_decrypt_code/<decrypt_code>')
+@bp.route('/copy_decrypt_code/<decrypt_code>')
 def copy_decrypt_code(decrypt_code):
     """Endpoint to help with copying decrypt code"""
     return jsonify({
@@ -641,22 +855,101 @@ def copy_decrypt_code(decrypt_code):
         'message': 'Decrypt code ready to copy'
     })
 
-@app.route('/logout')
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of request latency, hot-path timings and counters"""
+    gauges = {
+        'sse_subscribers': events.hub.subscriber_count(),
+        'pending_auto_deletes': expiry_scheduler.pending_count()
+    }
+    for name, stats in user_cache.stats().items():
+        gauges[f'{name}_cache_size'] = stats['size']
+        gauges[f'{name}_cache_hit_ratio'] = round(stats['hit_ratio'], 4)
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/logout')
 def logout():
     session.clear()
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
+
+def shutdown_services():
+    """Stop the threads and processes behind the current services and close their connections"""
+    write_queue.writer.shutdown()  # commits anything still queued, so before the pool closes
+    render_pool.pool.shutdown()
+    sticker_cache.cache.stop()
+    database.pool.close_all()
+
+def configure_services(config):
+    """Rebind the process-wide pools and stores to the settings in config.
+
+    The services they replace are shut down first, so an earlier app's
+    in-memory database, render processes and threads don't outlive it.
+    """
+    shutdown_services()
+    
+    blob_dir = config['BLOB_DIR']
+    if blob_dir is None:
+        blob_dir = config['BLOB_DIR'] = tempfile.mkdtemp(prefix='sticker-blobs-')
+        atexit.register(shutil.rmtree, blob_dir, ignore_errors=True)
+    
+    database.pool = database.ConnectionPool(config['DB_PATH'], config['DB_POOL_SIZE'])
+    blob_store.store = blob_store.BlobStore(blob_dir)
+    stickers.pool = stickers.StickerPool(config['STICKER_DIR'], config['STICKER_RELOAD_SECONDS'])
+    sticker_cache.cache = sticker_cache.TemplateCache(config['TEMPLATE_CACHE_SIZE'])
+    user_cache.configure(config['USER_CACHE_SIZE'], config['USER_CACHE_TTL'])
+    otp_store.store = otp_store.MemoryOTPStore(config['OTP_TTL_SECONDS'], config['OTP_MAX_ATTEMPTS'])
+    rate_limit.clients = rate_limit.TokenBucketLimiter(config['RATE_LIMIT_PER_SECOND'], config['RATE_LIMIT_BURST'])
+    rate_limit.phones = rate_limit.TokenBucketLimiter(config['PHONE_RATE_LIMIT_PER_SECOND'], config['PHONE_RATE_LIMIT_BURST'])
+    rate_limit.costs = dict(config['RATE_LIMIT_COSTS']) if config['RATE_LIMITING'] else {}
+    write_queue.writer = write_queue.WriteQueue(config['WRITE_BATCH_ROWS'])
+    render_pool.pool = render_pool.RenderPool(
+        config['RENDER_WORKERS'], config['RENDER_QUEUE_LIMIT'],
+        sticker_dir=config['STICKER_DIR'], template_cache_size=config['TEMPLATE_CACHE_SIZE'],
+    )
+
+def start_background_tasks():
+    # Expired messages are deleted in the background, never on the read path.
+    # Every worker loads the existing deadlines, so one that restarts after a
+    # crash still deletes on time; cleanup selects under the write lock, so the
+    # first worker whose timer fires does the deleting and the others find nothing left
+    print(f"Scheduled {expiry_scheduler.load_pending()} pending auto-deletes")
+    expiry_scheduler.start()
+
+def create_app(config=None):
+    """Build the app from a config class or profile name ('default', 'memory').
+
+    The database pool, blob store, sticker pool and render pool are shared by
+    the whole process, so the most recently created app owns them.
+    """
+    if config is None or isinstance(config, str):
+        config = PROFILES[config or os.environ.get('APP_PROFILE', 'default')]
+    
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.register_blueprint(bp)
+    
+    configure_services(app.config)
+    
+    # Initialize database (applies any pending migrations)
+    init_db()
+    
+    # Render workers decode the stickers themselves; only inline rendering
+    # needs them in this process, and then they're decoded once, up front
+    if app.config['RENDER_WORKERS'] <= 0:
+        stickers.pool.reload()
+        print(f"Found {len(stickers.pool.names())} stickers ready for random selection")
+    
+    if app.config['BACKGROUND_TASKS']:
+        start_background_tasks()
+    
+    return app
 
 if __name__ == '__main__':
     # Create directories
     os.makedirs('static/images', exist_ok=True)
     os.makedirs('templates', exist_ok=True)
     
-    # Check available stickers
-    available_stickers = get_all_available_stickers()
-    print(f"Found {len(available_stickers)} stickers ready for random selection")
-    
-    # Initialize database (this will add the missing column)
-    init_db()
+    app = create_app()
     
     print("Starting Flask app...")
     print("Open http://localhost:5000 in your browser")
@@ -0,0 +1 @@
+"""Offline benchmarks for the messaging hot paths; run modules with python -m benchmarks.<name>"""
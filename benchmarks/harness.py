@@ -0,0 +1,88 @@
+"""Shared helpers: timing, percentile summaries, JSON output and a throwaway app environment"""
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+import database
+from config import InMemoryConfig
+
+
+def best_of(func, repeat):
+    """Best wall time of `repeat` calls, in microseconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1e6
+
+
+def percentile(sorted_samples, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, max(0, int(round(fraction * len(sorted_samples))) - 1))
+    return sorted_samples[index]
+
+
+def summarize(samples, elapsed=None):
+    """Latency summary in milliseconds for a list of per-call durations in seconds"""
+    ordered = sorted(samples)
+    summary = {
+        'count': len(ordered),
+        'p50_ms': round(percentile(ordered, 0.50) * 1e3, 3) if ordered else None,
+        'p99_ms': round(percentile(ordered, 0.99) * 1e3, 3) if ordered else None,
+        'max_ms': round(ordered[-1] * 1e3, 3) if ordered else None,
+    }
+    if elapsed:
+        summary['throughput_per_s'] = round(len(ordered) / elapsed, 1)
+    return summary
+
+
+def environment_info():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def write_results(results, path=None):
+    """Print results as JSON and, when path is given, also save them there"""
+    text = json.dumps(results, indent=2)
+    if path:
+        with open(path, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+@contextmanager
+def temp_app(render_workers=0, in_memory=False, **settings):
+    """Build an app on a fresh SQLite file (or in-memory database) and blob directory.
+
+    Renders run inline by default so timings aren't skewed by worker start-up,
+    rate limiting is off since one simulated client sends everything,
+    and the app's print() logging goes to stderr so stdout stays valid JSON.
+    Keyword settings override any other config value.
+    """
+    import app as app_module
+
+    directory = tempfile.mkdtemp(prefix='sticker-bench-')
+    config = type('BenchmarkConfig', (InMemoryConfig,), {
+        'DB_PATH': database.MEMORY_DB if in_memory else os.path.join(directory, 'bench.db'),
+        'BLOB_DIR': os.path.join(directory, 'blobs'),
+        'RENDER_WORKERS': render_workers,
+        'RATE_LIMITING': False,
+        **settings,
+    })
+    try:
+        with redirect_stdout(sys.stderr):
+            yield app_module.create_app(config)
+    finally:
+        app_module.shutdown_services()
+        shutil.rmtree(directory, ignore_errors=True)
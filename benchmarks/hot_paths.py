@@ -0,0 +1,85 @@
+"""Micro-benchmarks for the functions every message goes through.
+
+    python -m benchmarks.hot_paths [--repeat N] [--expired 100,1000] [--output results.json]
+
+Covers generate_decrypt_code, text_to_image_steganography,
+extract_from_steganography and cleanup_expired_messages. The cleanup run
+uses a temporary SQLite file, so nothing touches messaging_app.db.
+"""
+import argparse
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+import database
+from steganography import extract_from_steganography, text_to_image_steganography
+from benchmarks.harness import best_of, environment_info, summarize, temp_app, write_results
+
+MESSAGE = 'Meet at the usual place at 7pm, bring the documents.'
+DECRYPT_CODE = 'Bench123'
+
+
+def seed_expired(count):
+    """Insert `count` messages whose auto-delete time has already passed"""
+    expired_at = (datetime.now() - timedelta(minutes=1)).isoformat()
+    with database.pool.connection() as conn:
+        conn.execute("INSERT OR IGNORE INTO users (phone_number, is_verified) VALUES ('+10000000000', TRUE)")
+        sender_id = conn.execute("SELECT id FROM users WHERE phone_number = '+10000000000'").fetchone()[0]
+        conn.executemany('''
+            INSERT INTO messages (sender_id, receiver_phone, message_text, auto_delete_time)
+            VALUES (?, ?, ?, ?)
+        ''', [(sender_id, f'+2{i % 50:010d}', MESSAGE, expired_at) for i in range(count)])
+
+
+def bench_cleanup(app_module, sizes, rounds):
+    """Time cleanup_expired_messages against freshly seeded expired rows, per batch size"""
+    results = {}
+    for size in sizes:
+        samples = []
+        for _ in range(rounds):
+            seed_expired(size)
+            start = time.perf_counter()
+            app_module.cleanup_expired_messages()
+            samples.append(time.perf_counter() - start)
+        results[str(size)] = summarize(samples)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--expired', default='100,1000,10000',
+                        help='comma-separated numbers of expired messages per cleanup run')
+    parser.add_argument('--rounds', type=int, default=5, help='cleanup runs per size')
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    args = parser.parse_args()
+
+    # Imported late so the app module picks up any environment the caller set
+    import app as app_module
+
+    # The first render loads the stickers, which logs; keep stdout valid JSON
+    with redirect_stdout(sys.stderr):
+        png = text_to_image_steganography(MESSAGE, DECRYPT_CODE, seed=1)
+    assert extract_from_steganography(png, DECRYPT_CODE) == MESSAGE
+
+    results = {
+        'environment': environment_info(),
+        'generate_decrypt_code_us': best_of(app_module.generate_decrypt_code, args.repeat),
+        'text_to_image_steganography_us': best_of(
+            lambda: text_to_image_steganography(MESSAGE, DECRYPT_CODE, seed=1), max(1, args.repeat // 10)),
+        'extract_from_steganography_us': best_of(
+            lambda: extract_from_steganography(png, DECRYPT_CODE), args.repeat),
+        'extract_wrong_code_us': best_of(
+            lambda: extract_from_steganography(png, 'WrongCode'), args.repeat),
+        'png_bytes': len(png),
+    }
+
+    with temp_app():
+        sizes = [int(size) for size in args.expired.split(',') if size]
+        results['cleanup_expired_messages'] = bench_cleanup(app_module, sizes, args.rounds)
+
+    write_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
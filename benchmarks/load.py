@@ -0,0 +1,152 @@
+"""Load driver: seed users, contacts and messages, then time the main endpoints.
+
+    python -m benchmarks.load [--users N] [--contacts M] [--messages 1000,10000,100000]
+                              [--requests R] [--in-memory] [--output results.json]
+
+Runs the real Flask routes through the test client against a temporary
+SQLite file, or a private in-memory database with --in-memory. The message
+count grows step by step and at each step the driver reports p50/p99
+latency and throughput for plain sends, encrypted sends, get_messages,
+get_timeline and decrypt_message. Requests are
+issued one at a time, so throughput is per request thread.
+"""
+import argparse
+import random
+import time
+import database
+from benchmarks.harness import environment_info, summarize, temp_app, write_results
+
+MESSAGE = 'Meet at the usual place at 7pm, bring the documents.'
+
+
+def phone_for(index):
+    return f'+1555{index:07d}'
+
+
+def seed_users(user_count, contact_count, rng):
+    """Create users and give each one `contact_count` random contacts; returns {user_id: [contact phones]}"""
+    with database.pool.connection() as conn:
+        conn.executemany('INSERT INTO users (phone_number, is_verified) VALUES (?, TRUE)',
+                         [(phone_for(i),) for i in range(user_count)])
+        user_ids = [row[0] for row in conn.execute('SELECT id FROM users ORDER BY id')]
+
+        contacts = {}
+        for index, user_id in enumerate(user_ids):
+            others = [i for i in rng.sample(range(user_count), min(contact_count + 1, user_count)) if i != index]
+            contacts[user_id] = [phone_for(i) for i in others[:contact_count]]
+        conn.executemany('INSERT INTO contacts (user_id, contact_phone, contact_name) VALUES (?, ?, ?)',
+                         [(user_id, phone, phone) for user_id, phones in contacts.items() for phone in phones])
+    return contacts
+
+
+def seed_messages(contacts, count, rng):
+    """Insert `count` plain messages between random users and their contacts"""
+    user_ids = [user_id for user_id, phones in contacts.items() if phones]
+    rows = []
+    for _ in range(count):
+        sender_id = rng.choice(user_ids)
+        rows.append((sender_id, rng.choice(contacts[sender_id]), MESSAGE))
+    with database.pool.connection() as conn:
+        conn.executemany('INSERT INTO messages (sender_id, receiver_phone, message_text) VALUES (?, ?, ?)', rows)
+
+
+def login(app, phone):
+    """A test client with a logged-in session, going through the real OTP routes"""
+    client = app.test_client()
+    otp = client.post('/send_otp', json={'phone_number': phone}).get_json()['otp']
+    assert client.post('/verify_otp', json={'phone_number': phone, 'otp': otp}).get_json()['success']
+    return client
+
+
+def measure(calls):
+    """Run each zero-argument call once and summarise latency; a falsy return counts as an error"""
+    samples = []
+    errors = 0
+    started = time.perf_counter()
+    for call in calls:
+        start = time.perf_counter()
+        ok = call()
+        samples.append(time.perf_counter() - start)
+        errors += not ok
+    summary = summarize(samples, time.perf_counter() - started)
+    summary['errors'] = errors
+    return summary
+
+
+def run_step(sessions, request_count, encrypted_count, rng):
+    """Time every endpoint once per request against the current data size"""
+    def send(client, receiver, encrypted):
+        def call():
+            response = client.post('/send_message', json={
+                'receiver_phone': receiver, 'message_text': MESSAGE, 'is_encrypted': encrypted
+            }).get_json()
+            if encrypted and response.get('success'):
+                sent.append((client, response['message_id'], response['decrypt_code']))
+            return response.get('success')
+        return call
+
+    def fetch(client, path):
+        return lambda: client.get(path).status_code == 200
+
+    def decrypt(client, message_id, decrypt_code):
+        return lambda: client.post('/decrypt_message', json={
+            'message_id': message_id, 'decrypt_code': decrypt_code
+        }).get_json().get('success')
+
+    sent = []
+    picks = [rng.choice(sessions) for _ in range(request_count)]
+    results = {
+        'send_message': measure(send(client, rng.choice(phones), False) for client, phones in picks),
+        'send_encrypted': measure(send(client, rng.choice(phones), True)
+                                  for client, phones in picks[:encrypted_count]),
+        'get_messages': measure(fetch(client, '/get_messages') for client, _ in picks),
+        'get_timeline': measure(fetch(client, '/get_timeline') for client, _ in picks),
+    }
+    results['decrypt_message'] = measure(decrypt(*entry) for entry in sent)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--contacts', type=int, default=20, help='contacts per user')
+    parser.add_argument('--messages', default='1000,10000,100000',
+                        help='comma-separated total message counts to measure at')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint per step')
+    parser.add_argument('--encrypted', type=int, default=20, help='encrypted sends (and decrypts) per step')
+    parser.add_argument('--clients', type=int, default=20, help='logged-in users issuing the requests')
+    parser.add_argument('--render-workers', type=int, default=0,
+                        help='render worker processes; 0 renders inline on the request thread')
+    parser.add_argument('--in-memory', action='store_true', help='use an in-memory database instead of a temp file')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sizes = sorted(int(size) for size in args.messages.split(',') if size)
+    results = {
+        'environment': environment_info(),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'steps': [],
+    }
+
+    with temp_app(render_workers=args.render_workers, in_memory=args.in_memory) as app:
+        contacts = seed_users(args.users, args.contacts, rng)
+        phones = {user_id: phone_for(i) for i, user_id in enumerate(contacts)}
+        active = rng.sample(list(contacts), min(args.clients, len(contacts)))
+        sessions = [(login(app, phones[user_id]), contacts[user_id]) for user_id in active]
+
+        seeded = 0
+        for size in sizes:
+            start = time.perf_counter()
+            seed_messages(contacts, size - seeded, rng)
+            seeded = size
+            step = {'messages': size, 'seed_seconds': round(time.perf_counter() - start, 3)}
+            step.update(run_step(sessions, args.requests, args.encrypted, rng))
+            results['steps'].append(step)
+
+    write_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
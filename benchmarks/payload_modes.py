@@ -0,0 +1,53 @@
+"""Compare the metadata and LSB payload modes: raw embed/extract and full encode/decrypt.
+
+    python -m benchmarks.payload_modes [--repeat N]
+"""
+import argparse
+import base64
+import json
+import sys
+from contextlib import redirect_stdout
+import lsb
+import stickers
+from steganography import extract_from_steganography, text_to_image_steganography
+from benchmarks.harness import best_of
+
+MESSAGE = 'Meet at the usual place at 7pm, bring the documents. ' * 4
+DECRYPT_CODE = 'Bench123'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    if not lsb.available():
+        raise SystemExit('NumPy is required for the lsb payload mode')
+
+    # Loading the stickers logs; keep stdout valid JSON
+    with redirect_stdout(sys.stderr):
+        _, sticker = stickers.pool.random_sticker()
+    payload = json.dumps({'message': MESSAGE, 'decrypt_code': DECRYPT_CODE}).encode()
+    embedded = lsb.embed(sticker, payload)
+
+    results = {
+        'sticker_size': list(sticker.size),
+        'payload_bytes': len(payload),
+        'lsb_embed_us': best_of(lambda: lsb.embed(sticker, payload), args.repeat),
+        'lsb_extract_us': best_of(lambda: lsb.extract(embedded), args.repeat),
+        'metadata_embed_us': best_of(lambda: base64.b64encode(payload).decode(), args.repeat),
+    }
+
+    for mode in ('metadata', 'lsb'):
+        png = text_to_image_steganography(MESSAGE, DECRYPT_CODE, seed=1, mode=mode)
+        assert extract_from_steganography(png, DECRYPT_CODE) == MESSAGE
+        results[f'{mode}_encode_us'] = best_of(
+            lambda: text_to_image_steganography(MESSAGE, DECRYPT_CODE, seed=1, mode=mode), max(1, args.repeat // 10))
+        results[f'{mode}_decrypt_us'] = best_of(
+            lambda: extract_from_steganography(png, DECRYPT_CODE), args.repeat)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
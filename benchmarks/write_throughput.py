@@ -0,0 +1,76 @@
+"""Concurrent senders: insert throughput with group commit versus one transaction per send.
+
+    python -m benchmarks.write_throughput [--senders 16] [--sends 200] [--output results.json]
+
+Every sender is its own logged-in test client on its own thread, posting
+plain /send_message requests as fast as it can. The run is repeated with
+WRITE_BATCH_ROWS=0 (each send commits on the request thread) and with the
+write queue, against a temporary SQLite file.
+"""
+import argparse
+import random
+import threading
+import time
+import metrics
+from benchmarks.harness import environment_info, summarize, temp_app, write_results
+from benchmarks.load import MESSAGE, login, phone_for, seed_users
+
+
+def counter(name):
+    return sum(value for (counter_name, _), value in metrics.snapshot()[0].items() if counter_name == name)
+
+
+def run(senders, sends, seed, **settings):
+    rng = random.Random(seed)
+    with temp_app(**settings) as app:
+        contacts = seed_users(senders, 5, rng)
+        clients = [(login(app, phone_for(i)), contacts[user_id]) for i, user_id in enumerate(contacts)]
+        samples = []
+        lock = threading.Lock()
+        batches_before = counter('write_batches_total')
+
+        def sender(client, phones):
+            own = []
+            for _ in range(sends):
+                start = time.perf_counter()
+                response = client.post('/send_message', json={'receiver_phone': rng.choice(phones), 'message_text': MESSAGE})
+                own.append(time.perf_counter() - start)
+                assert response.get_json()['success']
+            with lock:
+                samples.extend(own)
+
+        threads = [threading.Thread(target=sender, args=entry) for entry in clients]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        result = summarize(samples, elapsed)
+        if settings['WRITE_BATCH_ROWS']:
+            batches = counter('write_batches_total') - batches_before
+            result['rows_per_commit'] = round(len(samples) / batches, 1) if batches else None
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--senders', type=int, default=16, help='concurrent sending threads')
+    parser.add_argument('--sends', type=int, default=200, help='messages per sender')
+    parser.add_argument('--batch-rows', type=int, default=64, help='WRITE_BATCH_ROWS for the group-commit run')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    args = parser.parse_args()
+
+    results = {
+        'environment': environment_info(),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'per_request_commit': run(args.senders, args.sends, args.seed, WRITE_BATCH_ROWS=0),
+        'group_commit': run(args.senders, args.sends, args.seed, WRITE_BATCH_ROWS=args.batch_rows),
+    }
+    write_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
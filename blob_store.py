@@ -0,0 +1,81 @@
+"""Content-addressed on-disk store for encrypted sticker PNGs.
+
+Files live under <root>/<aa>/<bb>/<sha256> and the blobs table keeps a
+reference count per key, so the messages table only holds the key and size.
+"""
+import hashlib
+import os
+import tempfile
+
+BLOB_DIR = os.environ.get('BLOB_DIR', os.path.join('data', 'blobs'))
+
+
+class BlobStore:
+    def __init__(self, root=BLOB_DIR):
+        self.root = root
+
+    def path_for(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def write(self, data):
+        """Write data to disk if it is not already there and return (key, size)"""
+        key = hashlib.sha256(data).hexdigest()
+        path = self.path_for(key)
+
+        if not os.path.exists(path):
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            # Write to a temp file first so readers never see a half-written blob
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+        return key, len(data)
+
+    def read(self, key):
+        with open(self.path_for(key), 'rb') as f:
+            return f.read()
+
+    def exists(self, key):
+        return os.path.exists(self.path_for(key))
+
+    def add_reference(self, conn, key, size, count=1):
+        """Count `count` more messages pointing at key, inside the caller's transaction"""
+        conn.execute('''
+            INSERT INTO blobs (key, size, refcount) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET refcount = refcount + excluded.refcount
+        ''', (key, size, count))
+
+    def release(self, conn, keys):
+        """Drop one reference per key and return the keys nobody points at any more.
+
+        Pass the result to remove_files() once the transaction has committed.
+        """
+        keys = [key for key in keys if key]
+        if not keys:
+            return []
+
+        conn.executemany('UPDATE blobs SET refcount = refcount - 1 WHERE key = ?',
+                         [(key,) for key in keys])
+        placeholders = ','.join('?' * len(set(keys)))
+        orphaned = [row[0] for row in conn.execute(
+            f'SELECT key FROM blobs WHERE refcount <= 0 AND key IN ({placeholders})',
+            list(set(keys)))]
+        conn.executemany('DELETE FROM blobs WHERE key = ?', [(key,) for key in orphaned])
+        return orphaned
+
+    def remove_files(self, keys):
+        for key in keys:
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+
+
+store = BlobStore()
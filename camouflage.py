@@ -0,0 +1,45 @@
+"""Faint decorative shapes drawn over a sticker so encrypted stickers don't all look identical"""
+import random
+from PIL import Image, ImageDraw
+import metrics
+
+
+def random_shapes(rng=random):
+    """Pick 1-3 light, low-opacity shapes as (x, y, size, color, alpha) tuples"""
+    shapes = []
+    for _ in range(rng.randint(1, 3)):
+        shape_type = rng.choice(['circle', 'rectangle'])
+        color = tuple(rng.randint(200, 255) for _ in range(3))  # Light colors
+        alpha = rng.randint(30, 80)  # Low opacity
+
+        # Only circles are drawn; rectangles just leave the sticker untouched
+        if shape_type == 'circle':
+            x, y = rng.randint(0, 350), rng.randint(0, 250)
+            r = rng.randint(5, 15)
+            shapes.append((x, y, r, color, alpha))
+    return shapes
+
+
+@metrics.timed('camouflage_seconds')
+def apply_camouflage(img, rng=None, seed=None):
+    """Blend random circles into an RGB image in place and return it.
+
+    Each circle is composited on its own bounding box instead of a full-size
+    overlay, so the cost no longer depends on the sticker size. Pass seed
+    (or an rng) to get the same shapes every time.
+    """
+    if rng is None:
+        rng = random.Random(seed) if seed is not None else random
+
+    width, height = img.size
+    for x, y, r, color, alpha in random_shapes(rng):
+        box = (x, y, min(x + r + 1, width), min(y + r + 1, height))
+        if box[0] >= box[2] or box[1] >= box[3]:
+            continue
+
+        region = img.crop(box).convert('RGBA')
+        overlay = Image.new('RGBA', region.size, (0, 0, 0, 0))
+        ImageDraw.Draw(overlay).ellipse([0, 0, r, r], fill=(*color, alpha))
+        img.paste(Image.alpha_composite(region, overlay).convert('RGB'), box)
+
+    return img
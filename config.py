@@ -0,0 +1,65 @@
+"""Settings objects for create_app(); the defaults come from each module's environment knobs"""
+import os
+import blob_store
+import database
+import otp_store
+import rate_limit
+import render_pool
+import sticker_cache
+import stickers
+import user_cache
+import write_queue
+
+
+class Config:
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-this')
+
+    # SQLite file, or ':memory:' for a private shared-cache in-memory database
+    DB_PATH = database.DB_PATH
+    DB_POOL_SIZE = database.POOL_SIZE
+
+    # None puts blobs in a fresh temporary directory
+    BLOB_DIR = blob_store.BLOB_DIR
+
+    STICKER_DIR = stickers.STICKER_DIR
+    STICKER_RELOAD_SECONDS = stickers.RELOAD_CHECK_SECONDS
+    TEMPLATE_CACHE_SIZE = sticker_cache.TEMPLATE_CACHE_SIZE
+
+    USER_CACHE_SIZE = user_cache.USER_CACHE_SIZE
+    USER_CACHE_TTL = user_cache.USER_CACHE_TTL
+
+    OTP_TTL_SECONDS = otp_store.OTP_TTL_SECONDS
+    OTP_MAX_ATTEMPTS = otp_store.OTP_MAX_ATTEMPTS
+
+    # Per-client and per-phone token buckets; off when a caller drives load itself
+    RATE_LIMITING = True
+    RATE_LIMIT_PER_SECOND = rate_limit.RATE_LIMIT_PER_SECOND
+    RATE_LIMIT_BURST = rate_limit.RATE_LIMIT_BURST
+    PHONE_RATE_LIMIT_PER_SECOND = rate_limit.PHONE_RATE_LIMIT_PER_SECOND
+    PHONE_RATE_LIMIT_BURST = rate_limit.PHONE_RATE_LIMIT_BURST
+    RATE_LIMIT_COSTS = rate_limit.ROUTE_COSTS
+
+    # Message inserts are group-committed by one writer thread; 0 writes inline
+    WRITE_BATCH_ROWS = write_queue.WRITE_BATCH_ROWS
+
+    RENDER_WORKERS = render_pool.RENDER_WORKERS
+    RENDER_QUEUE_LIMIT = render_pool.RENDER_QUEUE_LIMIT
+
+    # Expiry scheduler thread; off when a caller drives cleanup itself
+    BACKGROUND_TASKS = True
+
+
+class InMemoryConfig(Config):
+    """Tests and benchmarks: nothing touches the working directory or outlives the app"""
+    TESTING = True
+    DB_PATH = database.MEMORY_DB
+    BLOB_DIR = None
+    TEMPLATE_CACHE_SIZE = 0
+    RENDER_WORKERS = 0
+    BACKGROUND_TASKS = False
+
+
+PROFILES = {
+    'default': Config,
+    'memory': InMemoryConfig,
+}
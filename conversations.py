@@ -0,0 +1,108 @@
+"""Per-(owner, peer) conversation summaries kept in step with the messages table.
+
+Every function that changes messages calls in here inside its own
+transaction, so a summary never points at a message that isn't there.
+Conversations are keyed by phone number on both sides because a receiver
+may not have an account yet.
+"""
+import database
+
+PREVIEW_LENGTH = 100
+
+_SIDEBAR_QUERY = '''
+    SELECT peer_phone, last_message_id, last_timestamp, preview, unread_count, last_auto_delete_time
+    FROM conversations
+    WHERE owner_phone = ?
+    ORDER BY last_message_id DESC
+'''
+
+
+def record_messages(conn, sender_phone, first_id, last_id):
+    """Fold the freshly inserted messages first_id..last_id from sender_phone into both sides' summaries"""
+    # SQLite fills the bare columns from the row that produced MAX(id)
+    conn.execute(f'''
+        INSERT INTO conversations (owner_phone, peer_phone, last_message_id, last_timestamp, preview, unread_count)
+        SELECT ?, receiver_phone, MAX(id), timestamp, SUBSTR(message_text, 1, {PREVIEW_LENGTH}), 0
+        FROM messages WHERE id BETWEEN ? AND ?
+        GROUP BY receiver_phone
+        ON CONFLICT (owner_phone, peer_phone) DO UPDATE SET
+            last_message_id = excluded.last_message_id,
+            last_timestamp = excluded.last_timestamp,
+            preview = excluded.preview,
+            last_auto_delete_time = NULL
+    ''', (sender_phone, first_id, last_id))
+    conn.execute(f'''
+        INSERT INTO conversations (owner_phone, peer_phone, last_message_id, last_timestamp, preview, unread_count)
+        SELECT receiver_phone, ?, MAX(id), timestamp, SUBSTR(message_text, 1, {PREVIEW_LENGTH}), COUNT(*)
+        FROM messages WHERE id BETWEEN ? AND ? AND receiver_phone != ?
+        GROUP BY receiver_phone
+        ON CONFLICT (owner_phone, peer_phone) DO UPDATE SET
+            last_message_id = excluded.last_message_id,
+            last_timestamp = excluded.last_timestamp,
+            preview = excluded.preview,
+            last_auto_delete_time = NULL,
+            unread_count = unread_count + excluded.unread_count
+    ''', (sender_phone, first_id, last_id, sender_phone))
+
+
+def _latest_between(conn, phone_a, phone_b):
+    """Newest message either way between two phones, via idx_messages_pair"""
+    latest = None
+    for sender_phone, receiver_phone in ((phone_a, phone_b), (phone_b, phone_a)):
+        row = conn.execute('''
+            SELECT m.id, m.timestamp, m.message_text, m.auto_delete_time FROM messages m
+            WHERE m.receiver_phone = ?
+            AND m.sender_id = (SELECT id FROM users WHERE phone_number = ?)
+            ORDER BY m.id DESC LIMIT 1
+        ''', (receiver_phone, sender_phone)).fetchone()
+        if row and (latest is None or row[0] > latest[0]):
+            latest = row
+    return latest
+
+
+def remove_messages(conn, deleted):
+    """Update summaries after deleting (message_id, sender_phone, receiver_phone) rows"""
+    # Deleted messages the receiver hadn't read yet no longer count as unread
+    conn.executemany('''
+        UPDATE conversations SET unread_count = MAX(unread_count - 1, 0)
+        WHERE owner_phone = ? AND peer_phone = ? AND last_read_id < ?
+    ''', [(receiver_phone, sender_phone, message_id)
+          for message_id, sender_phone, receiver_phone in deleted
+          if sender_phone and sender_phone != receiver_phone])
+
+    pairs = {tuple(sorted((sender_phone, receiver_phone)))
+             for _, sender_phone, receiver_phone in deleted if sender_phone}
+    for phone_a, phone_b in pairs:
+        sides = [(phone_a, phone_b), (phone_b, phone_a)]
+        latest = _latest_between(conn, phone_a, phone_b)
+        if latest is None:
+            conn.executemany('DELETE FROM conversations WHERE owner_phone = ? AND peer_phone = ?', sides)
+            continue
+        message_id, timestamp, text, auto_delete_time = latest
+        conn.executemany('''
+            UPDATE conversations SET last_message_id = ?, last_timestamp = ?, preview = ?,
+                last_auto_delete_time = ?, last_read_id = MIN(last_read_id, ?)
+            WHERE owner_phone = ? AND peer_phone = ?
+        ''', [(message_id, timestamp, text[:PREVIEW_LENGTH] if text else text, auto_delete_time, message_id, *side)
+              for side in sides])
+
+
+def schedule_deletion(conn, message_id, sender_phone, receiver_phone, delete_time):
+    """Note the deadline on both summaries when the message is the one they preview"""
+    conn.executemany('''
+        UPDATE conversations SET last_auto_delete_time = ?
+        WHERE owner_phone = ? AND peer_phone = ? AND last_message_id = ?
+    ''', [(delete_time, sender_phone, receiver_phone, message_id),
+          (delete_time, receiver_phone, sender_phone, message_id)])
+
+
+def mark_read(owner_phone, peer_phone):
+    database.execute('''
+        UPDATE conversations SET unread_count = 0, last_read_id = last_message_id
+        WHERE owner_phone = ? AND peer_phone = ?
+    ''', (owner_phone, peer_phone))
+
+
+def fetch_sidebar(owner_phone):
+    """Every conversation of a user, most recent first"""
+    return database.query_all(_SIDEBAR_QUERY, (owner_phone,))
@@ -0,0 +1,128 @@
+import os
+import sqlite3
+import threading
+import time
+import queue
+import uuid
+from contextlib import contextmanager
+import metrics
+
+DB_PATH = os.environ.get('DB_PATH', 'messaging_app.db')
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+# Pass as the path for an in-memory database shared by every connection in one pool
+MEMORY_DB = ':memory:'
+
+# Applied once per connection when it is opened
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',      # ~16 MB page cache per connection
+    'PRAGMA mmap_size = 134217728',    # 128 MB memory-mapped I/O
+    'PRAGMA temp_store = MEMORY',
+)
+
+
+class ConnectionPool:
+    """Pool of long-lived SQLite connections shared by all request threads"""
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        # Each in-memory pool gets its own named shared-cache database, so
+        # several pools in one process never see each other's tables
+        self._uri = f'file:memdb-{uuid.uuid4().hex}?mode=memory&cache=shared' if path == MEMORY_DB else None
+        self._idle = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self._uri or self.path,
+            uri=self._uri is not None,
+            timeout=5.0,
+            check_same_thread=False,
+            cached_statements=256,  # keep prepared statements around between requests
+        )
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        if self._uri:
+            # Shared-cache connections lock whole tables and don't honour the
+            # busy timeout; let readers skip a writer's lock instead of failing
+            conn.execute('PRAGMA read_uncommitted = 1')
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._all) < self.size:
+                conn = self._open()
+                self._all.append(conn)
+                return conn
+
+        # Pool exhausted, wait for another thread to hand a connection back
+        return self._idle.get()
+
+    def _release(self, conn):
+        self._idle.put(conn)
+
+    def prime(self):
+        """Open every connection now so the first requests don't pay for it"""
+        with self._lock:
+            while len(self._all) < self.size:
+                conn = self._open()
+                self._all.append(conn)
+                self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection; commits on success and rolls back on error"""
+        start = time.perf_counter()
+        conn = self._acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._release(conn)
+            metrics.observe('db_transaction_seconds', time.perf_counter() - start)
+
+    def close_all(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait()
+                except queue.Empty:
+                    break
+            for conn in self._all:
+                conn.close()
+            self._all = []
+
+
+pool = ConnectionPool(DB_PATH)
+
+# Columns per table, resolved once at startup by init_db
+schema = {}
+schema_version = 0
+
+
+def has_column(table, column):
+    return column in schema.get(table, ())
+
+
+def query_one(sql, params=()):
+    with pool.connection() as conn:
+        return conn.execute(sql, params).fetchone()
+
+
+def query_all(sql, params=()):
+    with pool.connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def execute(sql, params=()):
+    """Run a single write statement in its own transaction and return the cursor"""
+    with pool.connection() as conn:
+        return conn.execute(sql, params)
@@ -0,0 +1,40 @@
+"""Salted decrypt-code hashes stored next to each message, so wrong codes are rejected
+without reading or decoding the sticker, plus per-user failed-attempt counters"""
+import hashlib
+import hmac
+import os
+import secrets
+
+SALT_BYTES = 16
+# Wrong guesses allowed per user and message before further attempts are refused
+MAX_FAILED_ATTEMPTS = int(os.environ.get('MAX_DECRYPT_FAILURES', 10))
+
+
+def _digest(salt, code):
+    return hashlib.sha256(salt + code.encode()).hexdigest()
+
+
+def hash_code(code):
+    """Return 'salt$digest' (both hex) for storing in messages.decrypt_code_hash"""
+    salt = secrets.token_bytes(SALT_BYTES)
+    return f"{salt.hex()}${_digest(salt, code)}"
+
+
+def matches(code, stored):
+    """Constant-time check of a provided code against a stored 'salt$digest'"""
+    try:
+        salt_hex, expected = stored.split('$', 1)
+        actual = _digest(bytes.fromhex(salt_hex), code)
+    except (AttributeError, ValueError):
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+def record_failure(conn, message_id, user_id):
+    conn.execute('''
+        INSERT INTO decrypt_attempts (message_id, user_id, failures, last_failed_at)
+        VALUES (?, ?, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT (message_id, user_id) DO UPDATE SET
+            failures = failures + 1,
+            last_failed_at = CURRENT_TIMESTAMP
+    ''', (message_id, user_id))
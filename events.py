@@ -0,0 +1,209 @@
+"""Fan-out of real-time events (new messages, auto-deletes) to /stream subscribers"""
+import json
+import os
+import queue
+import socket
+import threading
+from collections import defaultdict
+
+SUBSCRIBER_QUEUE_SIZE = 256
+KEEPALIVE_SECONDS = 15
+
+# channel -> callbacks run for every event broadcast on that channel in any
+# worker; kept outside the hub so they survive set_hub(). Channels are a
+# separate namespace from subscriber keys, so nothing broadcast on one ever
+# reaches a /stream client
+_listeners = defaultdict(list)
+
+
+class Subscription:
+    """Per-connection event queue; overflowed is set when the client fell too far behind"""
+
+    def __init__(self, hub, key):
+        self.hub = hub
+        self.key = key
+        self.events = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+        self.closed = False
+
+    def close(self):
+        """End the stream; the client's EventSource reconnects on its own"""
+        self.closed = True
+        try:
+            self.events.put_nowait(None)  # wake the streaming thread
+        except queue.Full:
+            pass
+
+    def deliver(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout=KEEPALIVE_SECONDS):
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class MessageHub:
+    """Interface every hub implements; swap one in with set_hub()"""
+
+    def subscribe(self, key):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+    def publish(self, key, event, data):
+        raise NotImplementedError
+
+    def broadcast(self, channel, event, data):
+        """Run the listeners of channel in every process; never delivered to subscribers"""
+        raise NotImplementedError
+
+
+class InProcessHub(MessageHub):
+    """Delivers events to subscribers connected to this process only"""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, key):
+        subscription = Subscription(self, key)
+        with self._lock:
+            self._subscribers[key].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.key)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.key]
+
+    def publish(self, key, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(key, ()))
+        for subscription in subscribers:
+            subscription.deliver((event, data))
+
+    def broadcast(self, channel, event, data):
+        for callback in _listeners.get(channel, ()):
+            callback(event, data)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+    def close_all(self):
+        """Disconnect every subscriber, e.g. while a worker drains before exiting"""
+        with self._lock:
+            subscriptions = [s for subscribers in self._subscribers.values() for s in subscribers]
+        for subscription in subscriptions:
+            subscription.close()
+
+
+class UnixSocketHub(InProcessHub):
+    """Fans events out to sibling worker processes over Unix datagram sockets.
+
+    Every worker binds <directory>/worker-<index>.sock. publish() delivers to
+    local subscribers and sends one datagram to each sibling, which delivers
+    to its own; broadcast() does the same for listeners, in a datagram marked
+    so it never reaches subscribers. A sibling that is down or restarting just misses the event;
+    its clients catch up through /sync when they reconnect.
+    """
+
+    def __init__(self, directory, index, worker_count):
+        super().__init__()
+        self.address = self._address(directory, index)
+        self.peers = [self._address(directory, i) for i in range(worker_count) if i != index]
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self.address)
+        self._thread = threading.Thread(target=self._receive, name='event-hub', daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _address(directory, index):
+        return os.path.join(directory, f'worker-{index}.sock')
+
+    def publish(self, key, event, data):
+        super().publish(key, event, data)
+        self._send(['publish', key, event, data])
+
+    def broadcast(self, channel, event, data):
+        super().broadcast(channel, event, data)
+        self._send(['broadcast', channel, event, data])
+
+    def _send(self, message):
+        datagram = json.dumps(message).encode()
+        for peer in self.peers:
+            try:
+                # Never block a request thread on a sibling that isn't reading
+                self._socket.sendto(datagram, socket.MSG_DONTWAIT, peer)
+            except OSError:
+                pass
+
+    def _receive(self):
+        while True:
+            try:
+                kind, key, event, data = json.loads(self._socket.recv(1 << 20))
+            except OSError:
+                return  # socket closed
+            except ValueError:
+                continue
+            if kind == 'broadcast':
+                InProcessHub.broadcast(self, key, event, data)
+            else:
+                InProcessHub.publish(self, key, event, data)
+
+    def close(self):
+        self._socket.close()
+        try:
+            os.remove(self.address)
+        except FileNotFoundError:
+            pass
+
+
+hub = InProcessHub()
+
+
+def listen(channel, callback):
+    """Call callback(event, data) in this process for everything broadcast on channel"""
+    _listeners[channel].append(callback)
+
+
+def set_hub(new_hub):
+    """Replace the hub, e.g. with a pub/sub backed one when running several workers"""
+    global hub
+    hub = new_hub
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream(subscription):
+    """Generator of SSE frames for one subscriber; unsubscribes when the client goes away"""
+    try:
+        yield "retry: 3000\n\n"
+        while not subscription.closed:
+            if subscription.overflowed:
+                # We dropped events for this client, tell it to catch up through /sync
+                subscription.overflowed = False
+                yield format_sse('resync', {})
+
+            item = subscription.get()
+            if subscription.closed:
+                break
+            if item is None:
+                yield ": keepalive\n\n"
+                continue
+            yield format_sse(*item)
+    finally:
+        subscription.hub.unsubscribe(subscription)
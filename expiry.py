@@ -0,0 +1,81 @@
+"""Background deletion of auto-delete messages exactly when their deadline passes"""
+import heapq
+import threading
+from datetime import datetime
+import database
+
+
+class ExpiryScheduler:
+    """Min-heap of upcoming deadlines drained by a single daemon thread.
+
+    delete_expired is called with no arguments whenever the earliest deadline
+    passes and must remove every message whose auto_delete_time is due.
+    """
+
+    def __init__(self, delete_expired):
+        self.delete_expired = delete_expired
+        self._deadlines = []  # (deadline, message_id)
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def schedule(self, message_id, deadline):
+        if isinstance(deadline, str):
+            deadline = datetime.fromisoformat(deadline)
+        with self._condition:
+            heapq.heappush(self._deadlines, (deadline, message_id))
+            # Wake the worker in case this deadline is earlier than the one it sleeps on
+            self._condition.notify()
+
+    def load_pending(self):
+        """Pick up deadlines set before this process started"""
+        rows = database.query_all('''
+            SELECT id, auto_delete_time FROM messages
+            WHERE auto_delete_time IS NOT NULL
+        ''')
+        for message_id, deadline in rows:
+            self.schedule(message_id, deadline)
+        return len(rows)
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='expiry-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def pending_count(self):
+        with self._condition:
+            return len(self._deadlines)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopping:
+                    if self._deadlines:
+                        wait = (self._deadlines[0][0] - datetime.now()).total_seconds()
+                        if wait <= 0:
+                            break
+                        self._condition.wait(wait)
+                    else:
+                        self._condition.wait()
+                if self._stopping:
+                    return
+
+                now = datetime.now()
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    heapq.heappop(self._deadlines)
+
+            try:
+                self.delete_expired()
+            except Exception as e:
+                print(f"Error in expiry scheduler: {e}")
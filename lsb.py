@@ -0,0 +1,60 @@
+"""Vectorised least-significant-bit embedding of a payload in an RGB image's pixels.
+
+Layout: a 4-byte big-endian payload length followed by the payload, one bit
+per channel value in row-major RGB order. Needs NumPy; available() says
+whether this mode can be used.
+"""
+import struct
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency, only the 'lsb' payload mode needs it
+    np = None
+
+HEADER_BYTES = 4
+
+
+class PayloadTooLarge(ValueError):
+    """The payload does not fit in the chosen image"""
+
+
+def available():
+    return np is not None
+
+
+def capacity(size):
+    """Bytes of payload an RGB image of the given (width, height) can carry"""
+    width, height = size
+    return max(0, (width * height * 3) // 8 - HEADER_BYTES)
+
+
+def embed(img, payload):
+    """Return a new RGB image with payload hidden in the low bit of each channel"""
+    if len(payload) > capacity(img.size):
+        raise PayloadTooLarge(f"{len(payload)} byte payload exceeds {capacity(img.size)} byte capacity of {img.size} image")
+
+    pixels = np.array(img.convert('RGB'), dtype=np.uint8)
+    flat = pixels.reshape(-1)
+
+    data = np.frombuffer(struct.pack('>I', len(payload)) + payload, dtype=np.uint8)
+    bits = np.unpackbits(data)
+    flat[:bits.size] &= 0xFE
+    flat[:bits.size] |= bits
+
+    return Image.fromarray(pixels, 'RGB')
+
+
+def extract(img):
+    """Return the payload hidden by embed()"""
+    flat = np.asarray(img.convert('RGB'), dtype=np.uint8).reshape(-1)
+
+    header_bits = HEADER_BYTES * 8
+    if flat.size < header_bits:
+        raise ValueError('image too small to hold an LSB payload')
+    length, = struct.unpack('>I', np.packbits(flat[:header_bits] & 1).tobytes())
+
+    if length > capacity(img.size):
+        raise ValueError('no valid LSB payload in image')
+    end = header_bits + length * 8
+    return np.packbits(flat[header_bits:end] & 1).tobytes()
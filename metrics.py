@@ -0,0 +1,154 @@
+"""In-process counters and latency histograms exposed in Prometheus text format.
+
+Every thread records into its own shard, keyed by thread id, so the hot
+path never takes a lock; shards are only summed when /metrics is scraped.
+Worker processes hand their numbers to the parent with drain() / merge().
+"""
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from 100us to 10s
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_shards = {}  # thread id -> shard
+_shards_lock = threading.Lock()
+
+
+class _Shard:
+    def __init__(self):
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+
+
+def _shard():
+    ident = threading.get_ident()
+    shard = _shards.get(ident)
+    if shard is None:
+        # Thread ids are only reused once a thread has exited, so a new
+        # thread with a recycled id simply carries on its predecessor's shard
+        with _shards_lock:
+            shard = _shards.setdefault(ident, _Shard())
+    return shard
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    counters = _shard().counters
+    key = _key(name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    histograms = _shard().histograms
+    key = _key(name, labels)
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = [0] * (len(BUCKETS) + 2)
+    histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+    histogram[-1] += seconds
+
+
+@contextmanager
+def timer(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed(name, **labels):
+    """Decorator form of timer()"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _sum_shards(shards):
+    counters = {}
+    histograms = {}
+    for shard in shards:
+        for key, value in list(shard.counters.items()):
+            counters[key] = counters.get(key, 0) + value
+        for key, histogram in list(shard.histograms.items()):
+            total = histograms.setdefault(key, [0] * (len(BUCKETS) + 2))
+            for i, value in enumerate(histogram):
+                total[i] += value
+    return counters, histograms
+
+
+def snapshot():
+    """Sum every shard into (counters, histograms)"""
+    with _shards_lock:
+        shards = list(_shards.values())
+    return _sum_shards(shards)
+
+
+def drain():
+    """Snapshot and reset this process's metrics, e.g. to ship them from a worker process"""
+    with _shards_lock:
+        shards = list(_shards.values())
+        _shards.clear()
+    return _sum_shards(shards)
+
+
+def merge(drained):
+    """Add metrics drained from another process into this one"""
+    counters, histograms = drained
+    shard = _shard()
+    for key, value in counters.items():
+        shard.counters[key] = shard.counters.get(key, 0) + value
+    for key, histogram in histograms.items():
+        total = shard.histograms.setdefault(key, [0] * (len(BUCKETS) + 2))
+        for i, value in enumerate(histogram):
+            total[i] += value
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def render(gauges=None):
+    """Prometheus text exposition of everything recorded, plus optional {name: value} gauges"""
+    counters, histograms = snapshot()
+    lines = []
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f'# TYPE {name} counter')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f'# TYPE {name} histogram')
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+            count = cumulative + histogram[len(BUCKETS)]
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {histogram[-1]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+    for name, value in sorted((gauges or {}).items()):
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {value}')
+
+    return '\n'.join(lines) + '\n'
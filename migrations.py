@@ -0,0 +1,227 @@
+"""Ordered schema migrations for messaging_app.db"""
+import blob_store
+import decrypt_codes
+
+
+def _initial_schema(cursor):
+    # Users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phone_number TEXT UNIQUE NOT NULL,
+            otp TEXT,
+            is_verified BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Contacts table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS contacts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            contact_phone TEXT,
+            contact_name TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Messages table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_id INTEGER,
+            receiver_phone TEXT,
+            message_text TEXT,
+            encrypted_image BLOB,
+            decrypt_code TEXT,
+            is_encrypted BOOLEAN DEFAULT FALSE,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            auto_delete_time TIMESTAMP DEFAULT NULL,
+            FOREIGN KEY (sender_id) REFERENCES users (id)
+        )
+    ''')
+
+def _add_auto_delete_time(cursor):
+    # Databases created before auto-delete existed are missing this column
+    if 'auto_delete_time' not in _table_columns(cursor, 'messages'):
+        print("Adding auto_delete_time column to messages table...")
+        cursor.execute('ALTER TABLE messages ADD COLUMN auto_delete_time TIMESTAMP DEFAULT NULL')
+        print("Column added successfully!")
+
+def _timeline_indexes(cursor):
+    # Each side of the timeline UNION becomes an index range scan
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_receiver_id ON messages (receiver_phone, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_sender_id ON messages (sender_id, id)')
+
+def _message_tombstones(cursor):
+    # Records messages removed by auto-delete so /sync can tell clients to drop them
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS message_tombstones (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_id INTEGER NOT NULL,
+            sender_id INTEGER,
+            receiver_phone TEXT,
+            deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tombstones_receiver_id ON message_tombstones (receiver_phone, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tombstones_sender_id ON message_tombstones (sender_id, id)')
+
+def _external_image_blobs(cursor):
+    # Sticker PNGs move out of messages into the content-addressed blob store
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS blobs (
+            key TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    columns = _table_columns(cursor, 'messages')
+    if 'image_key' not in columns:
+        cursor.execute('ALTER TABLE messages ADD COLUMN image_key TEXT DEFAULT NULL')
+    if 'image_size' not in columns:
+        cursor.execute('ALTER TABLE messages ADD COLUMN image_size INTEGER DEFAULT NULL')
+
+    cursor.execute('SELECT id, encrypted_image FROM messages WHERE encrypted_image IS NOT NULL')
+    moved = 0
+    for message_id, image in cursor.fetchall():
+        key, size = blob_store.store.write(image)
+        blob_store.store.add_reference(cursor, key, size)
+        cursor.execute('''
+            UPDATE messages SET image_key = ?, image_size = ?, encrypted_image = NULL WHERE id = ?
+        ''', (key, size, message_id))
+        moved += 1
+    if moved:
+        print(f"Moved {moved} inline images to the blob store, run VACUUM to reclaim the space")
+
+def _auto_delete_index(cursor):
+    # Only messages with a pending auto-delete are indexed
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_auto_delete_time ON messages (auto_delete_time)
+        WHERE auto_delete_time IS NOT NULL
+    ''')
+
+def _conversations(cursor):
+    # One summary row per side of every conversation, so the sidebar is a single index scan
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversations (
+            owner_phone TEXT NOT NULL,
+            peer_phone TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            last_timestamp TIMESTAMP,
+            preview TEXT,
+            last_auto_delete_time TIMESTAMP DEFAULT NULL,
+            unread_count INTEGER NOT NULL DEFAULT 0,
+            last_read_id INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (owner_phone, peer_phone)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversations_owner_last ON conversations (owner_phone, last_message_id)')
+    # Latest message between two people is a single lookup per direction
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_pair ON messages (receiver_phone, sender_id, id)')
+
+    # Backfill from existing messages; history counts as already read
+    for owner, peer in (('u.phone_number', 'm.receiver_phone'), ('m.receiver_phone', 'u.phone_number')):
+        cursor.execute(f'''
+            INSERT INTO conversations (owner_phone, peer_phone, last_message_id)
+            SELECT {owner}, {peer}, MAX(m.id) FROM messages m
+            JOIN users u ON m.sender_id = u.id
+            WHERE true
+            GROUP BY {owner}, {peer}
+            ON CONFLICT (owner_phone, peer_phone)
+            DO UPDATE SET last_message_id = MAX(last_message_id, excluded.last_message_id)
+        ''')
+    cursor.execute('''
+        UPDATE conversations SET
+            last_timestamp = (SELECT timestamp FROM messages WHERE id = last_message_id),
+            preview = (SELECT SUBSTR(message_text, 1, 100) FROM messages WHERE id = last_message_id),
+            last_auto_delete_time = (SELECT auto_delete_time FROM messages WHERE id = last_message_id),
+            last_read_id = last_message_id
+    ''')
+
+def _decrypt_code_hashes(cursor):
+    # Wrong codes are rejected against this hash without touching the sticker
+    if 'decrypt_code_hash' not in _table_columns(cursor, 'messages'):
+        cursor.execute('ALTER TABLE messages ADD COLUMN decrypt_code_hash TEXT DEFAULT NULL')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS decrypt_attempts (
+            message_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            failures INTEGER NOT NULL DEFAULT 0,
+            last_failed_at TIMESTAMP,
+            PRIMARY KEY (message_id, user_id)
+        )
+    ''')
+
+    cursor.execute('SELECT id, decrypt_code FROM messages WHERE decrypt_code IS NOT NULL AND decrypt_code_hash IS NULL')
+    cursor.executemany('UPDATE messages SET decrypt_code_hash = ? WHERE id = ?',
+                       [(decrypt_codes.hash_code(code), message_id) for message_id, code in cursor.fetchall()])
+
+def _message_updates(cursor):
+    # Records stickers filled in after an async send, so /sync can resend those messages
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS message_updates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_id INTEGER NOT NULL,
+            sender_id INTEGER,
+            receiver_phone TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_updates_receiver_id ON message_updates (receiver_phone, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_updates_sender_id ON message_updates (sender_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_updates_message ON message_updates (message_id)')
+
+# (version, description, function) - append only, never renumber
+MIGRATIONS = [
+    (1, 'initial schema', _initial_schema),
+    (2, 'messages.auto_delete_time', _add_auto_delete_time),
+    (3, 'timeline indexes', _timeline_indexes),
+    (4, 'message tombstones', _message_tombstones),
+    (5, 'external image blobs', _external_image_blobs),
+    (6, 'auto-delete index', _auto_delete_index),
+    (7, 'conversations', _conversations),
+    (8, 'decrypt code hashes', _decrypt_code_hashes),
+    (9, 'message updates', _message_updates),
+]
+
+def _table_columns(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [column[1] for column in cursor.fetchall()]
+
+def current_version(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('SELECT MAX(version) FROM schema_version')
+    return cursor.fetchone()[0] or 0
+
+def run_migrations(conn):
+    """Apply every pending migration in order and return the resulting version"""
+    cursor = conn.cursor()
+    version = current_version(cursor)
+
+    for number, description, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        print(f"Applying migration {number}: {description}")
+        migrate(cursor)
+        cursor.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                       (number, description))
+        version = number
+
+    return version
+
+def load_schema(conn):
+    """Resolve the columns of every table so handlers never have to introspect"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+    tables = [row[0] for row in cursor.fetchall()]
+    return {table: frozenset(_table_columns(cursor, table)) for table in tables}
@@ -0,0 +1,152 @@
+"""Short-lived login codes, kept out of the users table.
+
+send_otp only issues a code here; the users row is written once, by
+verify_otp, when a code is accepted. Codes expire after OTP_TTL_SECONDS and
+a code is locked after OTP_MAX_ATTEMPTS wrong guesses until a new one is
+issued. MemoryOTPStore is private to one process; serve.py swaps in a
+SQLiteOTPStore on a file every worker opens, since a code issued through one
+worker may be verified through another.
+"""
+import hmac
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+OTP_TTL_SECONDS = float(os.environ.get('OTP_TTL_SECONDS', 300))
+OTP_MAX_ATTEMPTS = int(os.environ.get('OTP_MAX_ATTEMPTS', 5))
+
+# verify() results
+VERIFIED = 'verified'
+INVALID = 'invalid'
+EXPIRED = 'expired'  # also returned when no code was ever issued
+LOCKED = 'locked'
+
+
+def _check(entry_code, code):
+    return hmac.compare_digest(entry_code.encode(), str(code).encode())
+
+
+class MemoryOTPStore:
+    """Codes in a dict; every entry lives for the same ttl, so insertion order is expiry order"""
+
+    def __init__(self, ttl=OTP_TTL_SECONDS, max_attempts=OTP_MAX_ATTEMPTS):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self._entries = OrderedDict()  # phone -> [code, expires_at, failed_attempts]
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        while self._entries:
+            phone_number, entry = next(iter(self._entries.items()))
+            if entry[1] > now:
+                break
+            del self._entries[phone_number]
+
+    def issue(self, phone_number, code):
+        """Store code for phone_number, replacing any earlier one and its failed attempts"""
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            self._entries[phone_number] = [code, now + self.ttl, 0]
+            self._entries.move_to_end(phone_number)
+
+    def verify(self, phone_number, code):
+        """Check code and return VERIFIED, INVALID, EXPIRED or LOCKED; a verified code is used up"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(phone_number)
+            if entry is None or entry[1] <= now:
+                self._entries.pop(phone_number, None)
+                return EXPIRED
+            if entry[2] >= self.max_attempts:
+                return LOCKED
+            if _check(entry[0], code):
+                del self._entries[phone_number]
+                return VERIFIED
+            entry[2] += 1
+            return INVALID
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteOTPStore:
+    """Same contract as MemoryOTPStore, in a SQLite file shared by every process that opens it"""
+
+    def __init__(self, path, ttl=OTP_TTL_SECONDS, max_attempts=OTP_MAX_ATTEMPTS):
+        self.path = path
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # Opened on first use, so a store created before fork never shares a connection
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS otps (
+                    phone_number TEXT PRIMARY KEY,
+                    code TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    failed_attempts INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_otps_expires ON otps (expires_at)')
+            self._conn = conn
+        return self._conn
+
+    def issue(self, phone_number, code):
+        now = time.time()  # wall clock, since it's compared across processes
+        with self._lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM otps WHERE expires_at <= ?', (now,))
+                conn.execute('''
+                    INSERT INTO otps (phone_number, code, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT (phone_number) DO UPDATE SET
+                        code = excluded.code, expires_at = excluded.expires_at, failed_attempts = 0
+                ''', (phone_number, code, now + self.ttl))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def verify(self, phone_number, code):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                entry = conn.execute('SELECT code, expires_at, failed_attempts FROM otps WHERE phone_number = ?',
+                                     (phone_number,)).fetchone()
+                if entry is None or entry[1] <= now:
+                    conn.execute('DELETE FROM otps WHERE phone_number = ?', (phone_number,))
+                    result = EXPIRED
+                elif entry[2] >= self.max_attempts:
+                    result = LOCKED
+                elif _check(entry[0], code):
+                    conn.execute('DELETE FROM otps WHERE phone_number = ?', (phone_number,))
+                    result = VERIFIED
+                else:
+                    conn.execute('UPDATE otps SET failed_attempts = failed_attempts + 1 WHERE phone_number = ?',
+                                 (phone_number,))
+                    result = INVALID
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return result
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+store = MemoryOTPStore()
@@ -0,0 +1,47 @@
+"""Minimal PNG chunk walker for reading text chunks without decoding any pixels"""
+import struct
+import zlib
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_CHUNK_HEADER = struct.Struct('>I4s')
+
+
+def iter_chunks(data, stop_at_idat=True):
+    """Yield (chunk_type, payload memoryview) pairs; stops at the first IDAT by default"""
+    view = memoryview(data)
+    if bytes(view[:8]) != PNG_SIGNATURE:
+        raise ValueError('not a PNG file')
+
+    offset = 8
+    end = len(view)
+    while offset + 8 <= end:
+        length, chunk_type = _CHUNK_HEADER.unpack_from(view, offset)
+        if stop_at_idat and chunk_type == b'IDAT':
+            return
+        start = offset + 8
+        if start + length + 4 > end:
+            raise ValueError('truncated PNG chunk')
+        yield chunk_type, view[start:start + length]
+        if chunk_type == b'IEND':
+            return
+        offset = start + length + 4  # skip the CRC
+
+
+def find_text(data, keyword, stop_at_idat=True):
+    """Return the value of a tEXt/zTXt chunk, or None if it isn't found.
+
+    Only text chunks written before IDAT are seen unless stop_at_idat is False.
+    """
+    wanted = keyword.encode('latin-1')
+    for chunk_type, payload in iter_chunks(data, stop_at_idat):
+        if chunk_type not in (b'tEXt', b'zTXt'):
+            continue
+        raw = payload.tobytes()
+        name, _, value = raw.partition(b'\0')
+        if name != wanted:
+            continue
+        if chunk_type == b'zTXt':
+            # One compression-method byte, then a zlib stream
+            value = zlib.decompress(value[1:])
+        return value.decode('latin-1')
+    return None
@@ -0,0 +1,116 @@
+"""Token buckets that keep one client from monopolising the expensive routes.
+
+Each limited request spends tokens from its client's bucket (the logged-in
+user, or the remote address before login), and /send_otp also from the
+target phone's bucket. Costs per message are in ROUTE_COSTS; an encrypted
+send renders a sticker and costs several plain ones, and a batch pays for
+every message in it, going into debt when that is more than a full bucket
+holds. Buckets refill at a steady rate up to their burst size and live in a
+table split into independently locked shards, swept now and then for
+buckets that have refilled, since those are the same as no entry at all.
+With serve.py every worker keeps its own table, so a client's effective
+limit scales with the worker count.
+"""
+import math
+import os
+import threading
+import time
+
+RATE_LIMIT_PER_SECOND = float(os.environ.get('RATE_LIMIT_PER_SECOND', 5))
+RATE_LIMIT_BURST = float(os.environ.get('RATE_LIMIT_BURST', 30))
+# OTPs sent to any one phone, whoever asks for them
+PHONE_RATE_LIMIT_PER_SECOND = float(os.environ.get('PHONE_RATE_LIMIT_PER_SECOND', 0.1))
+PHONE_RATE_LIMIT_BURST = float(os.environ.get('PHONE_RATE_LIMIT_BURST', 3))
+SHARDS = 16
+SWEEP_SECONDS = 60.0
+
+# Endpoint -> tokens per message; '<endpoint>:encrypted' is the price of one that
+# needs a sticker rendered. /send_messages pays for every row and every render
+ROUTE_COSTS = {
+    'send_otp': 1,
+    'verify_otp': 1,
+    'decrypt_message': 1,
+    'send_message': 1,
+    'send_message:encrypted': 5,
+    'send_messages': 1,
+    'send_messages:encrypted': 5,
+}
+
+
+class _Shard:
+    def __init__(self):
+        self.buckets = {}  # key -> (tokens, updated_at)
+        self.lock = threading.Lock()
+        self.next_sweep = time.monotonic() + SWEEP_SECONDS
+
+
+class TokenBucketLimiter:
+    """Buckets of up to burst tokens per key, refilled at rate tokens per second"""
+
+    def __init__(self, rate, burst, shards=SHARDS):
+        self.rate = rate
+        self.burst = burst
+        self._shards = [_Shard() for _ in range(shards)]
+
+    def take(self, key, cost=1):
+        """Spend cost tokens from key's bucket; return 0 if that worked, else seconds until it would.
+
+        A cost above burst could never be covered up front, so it is let through
+        once the bucket is full and leaves it in debt: the full cost is still
+        paid off at rate before the key's next request gets in.
+        """
+        due = min(cost, self.burst)
+        shard = self._shards[hash(key) % len(self._shards)]
+        now = time.monotonic()
+        with shard.lock:
+            if now >= shard.next_sweep:
+                self._sweep(shard, now)
+            tokens, updated_at = shard.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens < due:
+                shard.buckets[key] = (tokens, now)
+                return (due - tokens) / self.rate
+            shard.buckets[key] = (tokens - cost, now)
+            return 0.0
+
+    def _sweep(self, shard, now):
+        shard.buckets = {key: (tokens, updated_at) for key, (tokens, updated_at) in shard.buckets.items()
+                         if tokens + (now - updated_at) * self.rate < self.burst}
+        shard.next_sweep = now + SWEEP_SECONDS
+
+    def __len__(self):
+        return sum(len(shard.buckets) for shard in self._shards)
+
+
+clients = TokenBucketLimiter(RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST)
+phones = TokenBucketLimiter(PHONE_RATE_LIMIT_PER_SECOND, PHONE_RATE_LIMIT_BURST)
+costs = dict(ROUTE_COSTS)  # empty when rate limiting is off
+
+
+def request_cost(endpoint, data):
+    """Tokens a request costs, or None when the endpoint isn't limited"""
+    cost = costs.get(endpoint)
+    if cost is None:
+        return None
+    encrypted_cost = costs.get(f'{endpoint}:encrypted', cost)
+
+    receiver_phones = data.get('receiver_phones')
+    if isinstance(receiver_phones, list) and receiver_phones:
+        # Broadcast: one sticker at most, shared by every row
+        return (encrypted_cost if data.get('is_encrypted') else cost) + cost * (len(receiver_phones) - 1)
+    items = data.get('messages')
+    if isinstance(items, list) and items:
+        return sum(encrypted_cost if isinstance(item, dict) and item.get('is_encrypted') else cost
+                   for item in items)
+    return encrypted_cost if data.get('is_encrypted') else cost
+
+
+def check(endpoint, client_key, data):
+    """Charge one request to its buckets; return whole seconds to wait, or 0 if it may proceed"""
+    cost = request_cost(endpoint, data)
+    if cost is None:
+        return 0
+    wait = clients.take(client_key, cost)
+    if not wait and endpoint == 'send_otp' and data.get('phone_number'):
+        wait = phones.take(str(data['phone_number']))
+    return math.ceil(wait)
@@ -0,0 +1,147 @@
+"""Renders encrypted stickers in worker processes so Flask request threads stay free"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import metrics
+import sticker_cache
+import stickers
+from steganography import DEFAULT_PAYLOAD_MODE, text_to_image_steganography
+
+# 0 workers renders inline on the request thread (handy for debugging)
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', min(4, os.cpu_count() or 1)))
+# Renders allowed in flight (running + queued) before callers get a 503
+RENDER_QUEUE_LIMIT = int(os.environ.get('RENDER_QUEUE_LIMIT', RENDER_WORKERS * 8 or 8))
+# Default for send_message when the request doesn't say; async returns before the image exists
+RENDER_ASYNC = os.environ.get('RENDER_ASYNC', '0') == '1'
+RETRY_AFTER_SECONDS = 2
+# Threads that run add_done_callback() work, off the executor's result thread
+CALLBACK_THREADS = 2
+
+
+class RenderPoolBusy(Exception):
+    """Raised when the render queue is full; callers should answer 503 + Retry-After"""
+
+
+def _init_worker(sticker_dir, template_cache_size):
+    # Decode the stickers once per worker instead of on its first job,
+    # and start pre-rendering templates before the first send arrives
+    stickers.pool = stickers.StickerPool(sticker_dir)
+    stickers.pool.reload()
+    sticker_cache.cache = sticker_cache.TemplateCache(template_cache_size)
+    sticker_cache.cache.start()
+
+
+def _render_job(text, decrypt_code, seed, mode):
+    # Runs in a worker: ship its timings (sticker load, camouflage, encode) back with the PNG
+    png = text_to_image_steganography(text, decrypt_code, seed=seed, mode=mode)
+    return png, metrics.drain()
+
+
+class RenderPool:
+    def __init__(self, workers=RENDER_WORKERS, queue_limit=RENDER_QUEUE_LIMIT,
+                 sticker_dir=stickers.STICKER_DIR, template_cache_size=sticker_cache.TEMPLATE_CACHE_SIZE):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.sticker_dir = sticker_dir
+        self.template_cache_size = template_cache_size
+        self._slots = threading.BoundedSemaphore(queue_limit)
+        self._executor = None
+        self._callbacks = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: the parent has SQLite connections and request threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.sticker_dir, self.template_cache_size),
+                )
+            return self._executor
+
+    def submit(self, text, decrypt_code, seed=None, mode=DEFAULT_PAYLOAD_MODE):
+        """Queue a render and return a Future for the PNG bytes, or raise RenderPoolBusy"""
+        if not self._slots.acquire(blocking=False):
+            metrics.inc('render_rejections_total')
+            raise RenderPoolBusy()
+
+        start = time.perf_counter()
+        future = Future()
+
+        def finish(job):
+            self._slots.release()
+            metrics.observe('render_seconds', time.perf_counter() - start, mode=mode)
+            if future.cancelled():
+                return
+            try:
+                png, worker_metrics = job.result()
+            except Exception as e:
+                future.set_exception(e)
+                return
+            metrics.merge(worker_metrics)
+            future.set_result(png)
+
+        if self.workers <= 0:
+            try:
+                future.set_result(text_to_image_steganography(text, decrypt_code, seed=seed, mode=mode))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._slots.release()
+                metrics.observe('render_seconds', time.perf_counter() - start, mode=mode)
+            return future
+
+        try:
+            job = self._get_executor().submit(_render_job, text, decrypt_code, seed, mode)
+        except Exception:
+            self._slots.release()
+            raise
+        job.add_done_callback(finish)
+        # Cancelling the caller's future drops the job if no worker has picked it up yet
+        future.add_done_callback(lambda done: done.cancelled() and job.cancel())
+        return future
+
+    def _get_callback_executor(self):
+        with self._lock:
+            if self._callbacks is None:
+                self._callbacks = ThreadPoolExecutor(max_workers=CALLBACK_THREADS, thread_name_prefix='render-callback')
+            return self._callbacks
+
+    def add_done_callback(self, future, fn):
+        """Call fn(future) on a helper thread once the render finishes.
+
+        Plain future.add_done_callback runs on the executor's result thread,
+        where a slow callback (a blob write, a busy database) would hold up
+        the results of every other render in flight.
+        """
+        future.add_done_callback(lambda done: self._get_callback_executor().submit(fn, done))
+
+    def warm(self):
+        """Start every worker process (and its sticker load) before traffic arrives"""
+        if self.workers <= 0:
+            return
+        executor = self._get_executor()
+        for job in [executor.submit(os.getpid) for _ in range(self.workers)]:
+            job.result()
+
+    def render(self, text, decrypt_code, seed=None, mode=DEFAULT_PAYLOAD_MODE):
+        """Render and wait for the result; the request thread just blocks on the future"""
+        return self.submit(text, decrypt_code, seed=seed, mode=mode).result()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+        # After the renders, whose results may still queue callbacks
+        with self._lock:
+            callbacks, self._callbacks = self._callbacks, None
+        if callbacks is not None:
+            callbacks.shutdown(wait=wait)
+
+
+pool = RenderPool()
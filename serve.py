@@ -0,0 +1,216 @@
+"""Production launcher: warm up once, then serve from N pre-forked worker processes.
+
+    python serve.py [--host 0.0.0.0] [--port 5000] [--workers N] [--profile default]
+
+The parent runs the migrations (and decodes the stickers when rendering
+inline), binds the listening socket and forks the workers, which share both.
+Each worker opens its own database connections, render processes and expiry
+scheduler, and events reach subscribers on any worker.
+
+SIGTERM or Ctrl+C drains: workers stop accepting, finish in-flight requests
+(up to --drain-timeout), close their streams and exit. Workers that crash
+are replaced. Without os.fork (Windows) or with --workers 1 it serves
+in-process.
+"""
+import argparse
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+from werkzeug.serving import make_server
+from werkzeug.wsgi import ClosingIterator
+import app as app_module
+import database
+import events
+import otp_store
+import render_pool
+import sticker_cache
+from config import PROFILES
+
+DRAIN_TIMEOUT_SECONDS = 10.0
+
+
+class InFlightCounter:
+    """WSGI middleware counting requests whose response hasn't been fully sent yet"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.active = 0
+        self._idle = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self._idle:
+            self.active += 1
+        try:
+            response = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self._finished()
+            raise
+        return ClosingIterator(response, self._finished)
+
+    def _finished(self):
+        with self._idle:
+            self.active -= 1
+            self._idle.notify_all()
+
+    def wait_idle(self, timeout):
+        with self._idle:
+            return self._idle.wait_for(lambda: self.active == 0, timeout)
+
+
+def init_worker(app, index, worker_count, hub_dir):
+    """Per-process setup after fork; nothing here may be inherited from the parent"""
+    database.pool.prime()
+    if hub_dir:
+        events.set_hub(events.UnixSocketHub(hub_dir, index, worker_count))
+        # A code sent through one worker may be checked by another
+        otp_store.store = otp_store.SQLiteOTPStore(os.path.join(hub_dir, 'otps.db'),
+                                                   app.config['OTP_TTL_SECONDS'], app.config['OTP_MAX_ATTEMPTS'])
+    if app.config['RENDER_WORKERS'] > 0:
+        render_pool.pool.warm()
+    else:
+        sticker_cache.cache.start()
+    if app.config['BACKGROUND_TASKS']:
+        app_module.start_background_tasks()
+
+
+def drain(server, counter, timeout):
+    """Stop taking new requests, let running ones finish, then release resources"""
+    server.shutdown()
+    events.hub.close_all()  # SSE clients reconnect, to a sibling worker if there is one
+    if not counter.wait_idle(timeout):
+        print(f"[{os.getpid()}] Drain timed out with {counter.active} requests in flight")
+    app_module.expiry_scheduler.stop()
+    app_module.shutdown_services()
+    if isinstance(events.hub, events.UnixSocketHub):
+        events.hub.close()
+    if isinstance(otp_store.store, otp_store.SQLiteOTPStore):
+        otp_store.store.close()
+
+
+def run_worker(app, server, counter, index, worker_count, hub_dir, drain_timeout):
+    stopping = threading.Event()
+
+    def request_stop(signum, frame):
+        if not stopping.is_set():
+            stopping.set()
+            # shutdown() waits for serve_forever(), so it can't run on this thread
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    init_worker(app, index, worker_count, hub_dir)
+    print(f"[{os.getpid()}] Worker {index} ready")
+    try:
+        server.serve_forever()
+    finally:
+        drain(server, counter, drain_timeout)
+        print(f"[{os.getpid()}] Worker {index} stopped")
+
+
+def fork_worker(app, server, counter, index, worker_count, hub_dir, drain_timeout):
+    sys.stdout.flush()  # or the child prints the parent's buffered output again
+    pid = os.fork()
+    if pid:
+        return pid
+    code = 0
+    try:
+        run_worker(app, server, counter, index, worker_count, hub_dir, drain_timeout)
+    except BaseException as e:
+        print(f"[{os.getpid()}] Worker {index} failed: {e}")
+        code = 1
+    finally:
+        sys.stdout.flush()
+        os._exit(code)
+
+
+def supervise(app, server, counter, worker_count, drain_timeout):
+    """Fork the workers, replace any that die, and stop them all on SIGTERM/SIGINT"""
+    hub_dir = tempfile.mkdtemp(prefix='sticker-hub-')
+    workers = {}  # pid -> index
+    stopping = threading.Event()
+
+    def request_stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    for index in range(worker_count):
+        workers[fork_worker(app, server, counter, index, worker_count, hub_dir, drain_timeout)] = index
+
+    while not stopping.is_set():
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid and pid in workers:
+            index = workers.pop(pid)
+            print(f"Worker {index} (pid {pid}) exited with status {status}, restarting")
+            workers[fork_worker(app, server, counter, index, worker_count, hub_dir, drain_timeout)] = index
+        stopping.wait(0.2)
+
+    print(f"Draining {len(workers)} workers...")
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    deadline = time.monotonic() + drain_timeout + 5
+    while workers and time.monotonic() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            workers.pop(pid, None)
+        else:
+            time.sleep(0.1)
+    for pid in workers:
+        os.kill(pid, signal.SIGKILL)
+
+    server.server_close()
+    shutil.rmtree(hub_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--profile', default=os.environ.get('APP_PROFILE', 'default'), choices=sorted(PROFILES))
+    parser.add_argument('--drain-timeout', type=float, default=DRAIN_TIMEOUT_SECONDS)
+    args = parser.parse_args()
+
+    forking = hasattr(os, 'fork') and args.workers > 1
+    if args.profile == 'memory' and forking:
+        sys.exit("The memory profile keeps its database inside one process; use --workers 1")
+
+    base = PROFILES[args.profile]
+    # Background threads don't survive fork, so create_app must not start
+    # them here; init_worker starts them in each worker instead
+    app = app_module.create_app(type('ServeConfig', (base,), {'BACKGROUND_TASKS': False}))
+    app.config['BACKGROUND_TASKS'] = base.BACKGROUND_TASKS
+
+    counter = InFlightCounter(app.wsgi_app)
+    app.wsgi_app = counter
+    server = make_server(args.host, args.port, app, threaded=True)
+    worker_count = args.workers if forking else 1
+    print(f"Listening on http://{args.host}:{args.port} with {worker_count} worker{'s' if worker_count > 1 else ''}")
+
+    if forking:
+        # SQLite connections must not cross a fork; workers open their own
+        database.pool.close_all()
+        supervise(app, server, counter, args.workers, args.drain_timeout)
+    else:
+        run_worker(app, server, counter, 0, 1, None, args.drain_timeout)
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Hiding messages inside sticker images and getting them back out"""
+import base64
+import io
+import json
+import os
+import random
+from datetime import datetime
+from PIL import Image, ImageDraw, ImageFont
+from PIL.PngImagePlugin import PngInfo
+import lsb
+import metrics
+import png_chunks
+import sticker_cache
+
+# 'metadata' hides the message in a PNG text chunk, 'lsb' in the pixels themselves
+PAYLOAD_MODES = ('metadata', 'lsb')
+DEFAULT_PAYLOAD_MODE = 'metadata'
+
+# PNG encoder knobs: lower compress_level is faster, optimize trades a lot of CPU for size
+PNG_COMPRESS_LEVEL = int(os.environ.get('PNG_COMPRESS_LEVEL', 6))
+PNG_OPTIMIZE = os.environ.get('PNG_OPTIMIZE', '0') == '1'
+
+
+def _payload(text, decrypt_code):
+    """The JSON hidden in a sticker: the actual message and its decrypt code"""
+    return json.dumps({
+        'message': text,
+        'decrypt_code': decrypt_code,
+        # Fixed width, so payload_size() is exact whenever it's measured
+        'timestamp': datetime.now().isoformat(timespec='microseconds')
+    }).encode()
+
+
+def payload_size(text, decrypt_code):
+    """Bytes the hidden JSON takes, including the escapes for non-ASCII text"""
+    return len(_payload(text, decrypt_code))
+
+
+def text_to_image_steganography(text, decrypt_code, image_path=None, seed=None, mode=DEFAULT_PAYLOAD_MODE):
+    """Convert text to steganography image using a random sticker as base.
+
+    A seed makes the sticker choice and camouflage reproducible (benchmarks, tests).
+    Raises lsb.PayloadTooLarge when an 'lsb' message doesn't fit in the chosen sticker.
+    """
+    if mode not in PAYLOAD_MODES:
+        raise ValueError(f"Unknown payload mode: {mode}")
+    
+    try:
+        # Random sticker with subtle camouflage shapes, so it looks more natural.
+        # Normally pre-rendered in the background; seeded renders are built fresh.
+        if seed is not None:
+            base_img = sticker_cache.render_template(random.Random(seed))
+        else:
+            base_img = sticker_cache.cache.take()
+        
+
+        # Create PngInfo object for metadata; text chunks land before IDAT
+        # so extract_from_steganography can stop scanning before the pixel data
+        pnginfo = PngInfo()
+        
+        if mode == 'lsb':
+            # Hide the JSON in the pixels' low bits and only mark the mode in metadata
+            base_img = lsb.embed(base_img, _payload(text, decrypt_code))
+            pnginfo.add_text("payload_mode", "lsb")
+        else:
+            # Convert to base64 and hide in image
+            encoded_data = base64.b64encode(_payload(text, decrypt_code)).decode()
+            pnginfo.add_text("hidden_message", encoded_data)
+        pnginfo.add_text("sticker_type", "encrypted_sticker")
+        
+        # Save to bytes with proper PNG info
+        img_buffer = io.BytesIO()
+        with metrics.timer('png_encode_seconds', mode=mode):
+            base_img.save(img_buffer, format='PNG', pnginfo=pnginfo,
+                          compress_level=PNG_COMPRESS_LEVEL, optimize=PNG_OPTIMIZE)
+        img_buffer.seek(0)
+        
+        return img_buffer.getvalue()
+        
+    except lsb.PayloadTooLarge:
+        raise
+    except Exception as e:
+        print(f"Error in text_to_image_steganography: {e}")
+        # Fallback: create simple image
+        base_img = Image.new('RGB', (400, 300), (255, 182, 193))
+        draw = ImageDraw.Draw(base_img)
+        
+        try:
+            font = ImageFont.truetype("arial.ttf", 16)
+        except:
+            font = ImageFont.load_default()
+            
+        draw.text((50, 150), "Encrypted Sticker Message", fill=(0, 0, 0), font=font)
+        
+        img_buffer = io.BytesIO()
+        base_img.save(img_buffer, format='PNG')
+        img_buffer.seek(0)
+        
+        return img_buffer.getvalue()
+
+def _reveal(encoded_data, provided_code):
+    decoded_data = base64.b64decode(encoded_data).decode()
+    return _verify(json.loads(decoded_data), provided_code)
+
+def _verify(message_data, provided_code):
+    # Verify decrypt code
+    if message_data['decrypt_code'] == provided_code:
+        return message_data['message']
+    return None
+
+@metrics.timed('steganography_extract_seconds')
+def extract_from_steganography(image_data, provided_code):
+    """Extract hidden message from steganography image"""
+    try:
+        # Fast path: read the tEXt chunk straight from the bytes, without decoding the image
+        encoded_data = png_chunks.find_text(image_data, 'hidden_message')
+        if encoded_data is not None:
+            return _reveal(encoded_data, provided_code)
+        
+        # Pixel-domain payloads need the image decoded
+        if png_chunks.find_text(image_data, 'payload_mode') == 'lsb':
+            with Image.open(io.BytesIO(image_data)) as img:
+                return _verify(json.loads(lsb.extract(img)), provided_code)
+        
+        img_buffer = io.BytesIO(image_data)
+        img = Image.open(img_buffer)
+        
+        # Try to get the hidden message from text metadata
+        if hasattr(img, 'text') and 'hidden_message' in img.text:
+            return _reveal(img.text['hidden_message'], provided_code)
+                
+        # Fallback: check info attribute (older method)
+        elif hasattr(img, 'info') and 'hidden_message' in img.info:
+            return _reveal(img.info['hidden_message'], provided_code)
+                
+        return None
+        
+    except Exception as e:
+        print(f"Decryption error: {e}")
+        return None
@@ -0,0 +1,87 @@
+"""Pre-rendered, pre-camouflaged sticker templates refilled by a background thread.
+
+An encrypted send takes a ready template, so only the payload step and the
+final PNG encode are left on its path.
+"""
+import os
+import random
+import threading
+from collections import deque
+import camouflage
+import metrics
+import stickers
+
+TEMPLATE_CACHE_SIZE = int(os.environ.get('TEMPLATE_CACHE_SIZE', 16))
+
+
+def render_template(rng=random):
+    """A random sticker with camouflage applied, ready to carry a payload"""
+    _, img = stickers.pool.random_sticker(rng)
+    return camouflage.apply_camouflage(img, rng)
+
+
+class TemplateCache:
+    def __init__(self, size=TEMPLATE_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._templates = deque()
+        self._lock = threading.Lock()
+        self._wanted = threading.Event()
+        self._thread = None
+        self._stopping = False
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None or self.size <= 0 or self._stopping:
+                return
+            self._thread = threading.Thread(target=self._refill, name='sticker-template-refill', daemon=True)
+            self._thread.start()
+        self._wanted.set()
+
+    def take(self):
+        """Return a template the caller owns; renders one on the spot when the cache is empty"""
+        if self._thread is None:
+            self.start()
+
+        try:
+            template = self._templates.popleft()
+        except IndexError:
+            template = None
+
+        with self._lock:
+            if template is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.inc('sticker_template_cache_total', result='hit' if template is not None else 'miss')
+
+        self._wanted.set()
+        return template if template is not None else render_template()
+
+    def stats(self):
+        return {'size': len(self._templates), 'capacity': self.size, 'hits': self.hits, 'misses': self.misses}
+
+    def stop(self):
+        """End the refill thread and drop the templates; take() then renders on the spot"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+        self._wanted.set()
+        if thread is not None:
+            thread.join()
+        self._templates.clear()
+
+    def _refill(self):
+        while not self._stopping:
+            self._wanted.wait()
+            self._wanted.clear()
+            while not self._stopping and len(self._templates) < self.size:
+                try:
+                    self._templates.append(render_template())
+                except Exception as e:
+                    print(f"Error pre-rendering sticker template: {e}")
+                    break
+
+
+cache = TemplateCache()
@@ -0,0 +1,172 @@
+"""Decoded, normalised sticker images kept in memory for the steganography encoder"""
+import os
+import random
+import threading
+import time
+from PIL import Image, ImageDraw, ImageFont
+import metrics
+
+STICKER_DIR = os.environ.get('STICKER_DIR', os.path.join('static', 'images'))
+STICKER_SIZE = (400, 300)
+STICKER_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+FALLBACK_STICKER = 'fallback_sticker.png'
+RELOAD_CHECK_SECONDS = 2.0
+
+
+def create_fallback_sticker(stickers_dir=STICKER_DIR):
+    """Create a simple fallback sticker if no stickers are found"""
+    os.makedirs(stickers_dir, exist_ok=True)
+    sticker_path = os.path.join(stickers_dir, FALLBACK_STICKER)
+
+    # Create a simple colorful sticker
+    img = Image.new('RGB', (400, 300), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+
+    # Draw a colorful background pattern
+    colors = [(255, 182, 193), (173, 216, 230), (144, 238, 144), (255, 218, 185), (221, 160, 221)]
+    for i in range(5):
+        color = colors[i]
+        draw.rectangle([i*80, 0, (i+1)*80, 300], fill=color)
+
+    # Add some decorative elements
+    draw.ellipse([50, 50, 150, 150], fill=(255, 255, 0))
+    draw.ellipse([250, 150, 350, 250], fill=(255, 0, 255))
+    draw.rectangle([150, 200, 250, 250], fill=(0, 255, 255))
+
+    # Add text
+    try:
+        font = ImageFont.truetype("arial.ttf", 20)
+    except:
+        font = ImageFont.load_default()
+
+    draw.text((160, 120), "FALLBACK", fill=(0, 0, 0), font=font)
+
+    img.save(sticker_path)
+    print(f"Created fallback sticker at {sticker_path}")
+    return sticker_path
+
+
+def normalized_size(size):
+    """The (width, height) load_sticker gives an image of the given size"""
+    if size[0] > STICKER_SIZE[0] or size[1] > STICKER_SIZE[1]:
+        return STICKER_SIZE
+    return size
+
+
+@metrics.timed('sticker_load_seconds')
+def load_sticker(path):
+    """Decode a sticker and normalise it to an RGB image no larger than STICKER_SIZE"""
+    with Image.open(path) as img:
+        img = img.convert('RGB')
+    if normalized_size(img.size) != img.size:
+        img = img.resize(STICKER_SIZE, Image.Resampling.LANCZOS)
+    return img
+
+
+class StickerPool:
+    """Keeps every sticker decoded in memory and reloads files whose mtime changed"""
+
+    def __init__(self, directory=STICKER_DIR, check_interval=RELOAD_CHECK_SECONDS):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._stickers = {}  # file name -> (mtime, image)
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        self._sizes = {}  # file name -> (mtime, normalised size), from headers only
+        self._next_size_check = 0.0
+        self._smallest = STICKER_SIZE
+
+    def _scan(self):
+        files = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.lower().endswith(STICKER_EXTENSIONS):
+                        files[entry.name] = entry.stat().st_mtime
+        except FileNotFoundError:
+            pass
+        return files
+
+    def reload(self):
+        """Decode new or changed stickers and forget removed ones"""
+        files = self._scan()
+        current = self._stickers
+        stickers = {}
+
+        for name, mtime in files.items():
+            cached = current.get(name)
+            if cached and cached[0] == mtime:
+                stickers[name] = cached
+                continue
+            try:
+                stickers[name] = (mtime, load_sticker(os.path.join(self.directory, name)))
+            except Exception as e:
+                print(f"Error loading sticker {name}: {e}")
+
+        if stickers.keys() != current.keys():
+            print(f"Loaded {len(stickers)} stickers from {self.directory}: {sorted(stickers)}")
+
+        with self._lock:
+            self._stickers = stickers
+            self._next_check = time.monotonic() + self.check_interval
+
+    def _refresh_if_due(self):
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_check:
+                return
+            # Claim this check so concurrent senders don't all rescan the folder
+            self._next_check = now + self.check_interval
+        self.reload()
+
+    def smallest_size(self):
+        """Normalised size of the smallest sticker a render may pick, without decoding any.
+
+        Request processes use this to check that a payload fits before accepting
+        a message, even when only the render workers hold decoded stickers.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_size_check:
+                return self._smallest
+            self._next_size_check = now + self.check_interval
+
+        sizes = {}
+        for name, mtime in self._scan().items():
+            cached = self._sizes.get(name)
+            if cached and cached[0] == mtime:
+                sizes[name] = cached
+                continue
+            try:
+                with Image.open(os.path.join(self.directory, name)) as img:
+                    sizes[name] = (mtime, normalized_size(img.size))
+            except Exception as e:
+                print(f"Error reading sticker {name}: {e}")
+
+        # No stickers means the fallback gets created, at STICKER_SIZE
+        smallest = min((size for _, size in sizes.values()), key=lambda size: size[0] * size[1], default=STICKER_SIZE)
+        with self._lock:
+            self._sizes = sizes
+            self._smallest = smallest
+        return smallest
+
+    def names(self):
+        self._refresh_if_due()
+        return sorted(self._stickers)
+
+    def random_sticker(self, rng=random):
+        """Return (name, image) with a private copy the caller may draw on"""
+        self._refresh_if_due()
+        stickers = self._stickers
+
+        if not stickers:
+            print("No stickers found in static/images folder!")
+            create_fallback_sticker(self.directory)
+            self.reload()
+            stickers = self._stickers
+
+        name = rng.choice(sorted(stickers))
+        return name, stickers[name][1].copy()
+
+
+pool = StickerPool()
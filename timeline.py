@@ -0,0 +1,151 @@
+"""Keyset-paginated message timeline and delta sync, backed by (receiver_phone, id) and (sender_id, id) indexes"""
+import base64
+from datetime import datetime
+import database
+import user_cache
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+MESSAGE_COLUMNS = 'id, sender_id, receiver_phone, message_text, is_encrypted, timestamp, decrypt_code, auto_delete_time, image_key'
+
+# Each arm is its own index range scan; UNION also drops messages a user sent to themselves twice.
+# Messages past their auto-delete deadline are hidden until the expiry scheduler removes them.
+_PAGE_QUERY = f'''
+    SELECT {MESSAGE_COLUMNS}
+    FROM (
+        SELECT * FROM (
+            SELECT {MESSAGE_COLUMNS} FROM messages
+            WHERE receiver_phone = ? AND id {{op}} ?
+            AND (auto_delete_time IS NULL OR auto_delete_time > ?)
+            ORDER BY id {{direction}} LIMIT ?
+        )
+        UNION
+        SELECT * FROM (
+            SELECT {MESSAGE_COLUMNS} FROM messages
+            WHERE sender_id = ? AND id {{op}} ?
+            AND (auto_delete_time IS NULL OR auto_delete_time > ?)
+            ORDER BY id {{direction}} LIMIT ?
+        )
+    )
+    ORDER BY id {{direction}}
+    LIMIT ?
+'''
+
+_OLDER_QUERY = _PAGE_QUERY.format(op='<', direction='DESC')
+_NEWER_QUERY = _PAGE_QUERY.format(op='>', direction='ASC')
+
+
+def _with_sender_phones(rows):
+    """Swap sender_id for the sender's phone, resolved through the user cache.
+
+    Messages whose sender no longer exists are dropped, as the old join with users did.
+    """
+    phones = user_cache.phones_for_users(row[1] for row in rows)
+    return [(row[0], phones[row[1]], *row[2:]) for row in rows if row[1] in phones]
+
+
+def clamp_page_size(limit):
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def fetch_page(user_id, user_phone, before_id=None, after_id=None, limit=DEFAULT_PAGE_SIZE):
+    """Return messages for a user newest first.
+
+    With after_id the page holds the `limit` messages right after that id,
+    otherwise the `limit` messages right before before_id (or the latest ones).
+    A limit of -1 means no limit.
+    """
+    now = datetime.now().isoformat()
+    if after_id is not None:
+        rows = database.query_all(_NEWER_QUERY, (user_phone, after_id, now, limit,
+                                                 user_id, after_id, now, limit, limit))
+        rows.reverse()
+        return _with_sender_phones(rows)
+
+    if before_id is None:
+        before_id = 2 ** 63 - 1
+    return _with_sender_phones(database.query_all(_OLDER_QUERY, (user_phone, before_id, now, limit,
+                                                                 user_id, before_id, now, limit, limit)))
+
+
+def fetch_message(message_id):
+    """Return a single message in the same column layout as fetch_page"""
+    row = database.query_one(f'SELECT {MESSAGE_COLUMNS} FROM messages WHERE id = ?', (message_id,))
+    rows = _with_sender_phones([row] if row else [])
+    return rows[0] if rows else None
+
+
+def fetch_message_range(first_id, last_id):
+    """Return messages first_id..last_id (inclusive) in the fetch_message layout, oldest first"""
+    return _with_sender_phones(database.query_all(
+        f'SELECT {MESSAGE_COLUMNS} FROM messages WHERE id BETWEEN ? AND ? ORDER BY id', (first_id, last_id)))
+
+
+_TOMBSTONE_QUERY = '''
+    SELECT id, message_id FROM message_tombstones WHERE receiver_phone = ? AND id > ?
+    UNION
+    SELECT id, message_id FROM message_tombstones WHERE sender_id = ? AND id > ?
+    ORDER BY id
+'''
+
+
+# Messages changed since they were first delivered; expired ones are left to their tombstones
+_UPDATE_QUERY = f'''
+    SELECT u.id, {', '.join('m.' + column for column in MESSAGE_COLUMNS.split(', '))}
+    FROM message_updates u
+    JOIN messages m ON m.id = u.message_id
+    WHERE u.id IN (
+        SELECT id FROM message_updates WHERE receiver_phone = ? AND id > ?
+        UNION
+        SELECT id FROM message_updates WHERE sender_id = ? AND id > ?
+    )
+    AND (m.auto_delete_time IS NULL OR m.auto_delete_time > ?)
+    ORDER BY u.id
+'''
+
+
+def encode_cursor(last_message_id, last_tombstone_id, last_update_id):
+    raw = f"{last_message_id}:{last_tombstone_id}:{last_update_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    """Return (last_message_id, last_tombstone_id, last_update_id), or None for a missing/garbled cursor"""
+    if not cursor:
+        return None
+    try:
+        parts = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        if len(parts) == 2:
+            parts.append(0)  # issued before updates were synced: resend any that are still live
+        message_id, tombstone_id, update_id = parts
+        return int(message_id), int(tombstone_id), int(update_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def latest_tombstone_id():
+    return database.query_one('SELECT COALESCE(MAX(id), 0) FROM message_tombstones')[0]
+
+
+def fetch_tombstones(user_id, user_phone, since_tombstone_id):
+    """Return (tombstone_id, message_id) pairs for messages deleted after the cursor"""
+    return database.query_all(_TOMBSTONE_QUERY, (user_phone, since_tombstone_id,
+                                                 user_id, since_tombstone_id))
+
+
+def latest_update_id():
+    return database.query_one('SELECT COALESCE(MAX(id), 0) FROM message_updates')[0]
+
+
+def fetch_updates(user_id, user_phone, since_update_id):
+    """Return (last_update_id, messages) for messages updated after the cursor, in the fetch_message layout"""
+    rows = database.query_all(_UPDATE_QUERY, (user_phone, since_update_id, user_id, since_update_id,
+                                              datetime.now().isoformat()))
+    if not rows:
+        return since_update_id, []
+    return rows[-1][0], _with_sender_phones([row[1:] for row in rows])
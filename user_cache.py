@@ -0,0 +1,166 @@
+"""Read-through caches for users and contact lists, which change far less often than they're read.
+
+Writers call the invalidate_* functions after their transaction commits. The
+invalidation is broadcast to the event hub's listeners, never to /stream
+subscribers, so with serve.py it reaches every worker's copy, and the TTL
+bounds anything that still slips through.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+import database
+import events
+import metrics
+
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 300))
+INVALIDATION_CHANNEL = 'cache_invalidation'
+
+
+class LRUCache:
+    """Size-bounded mapping whose entries also expire ttl seconds after they were stored"""
+
+    def __init__(self, name, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        metrics.inc('cache_requests_total', cache=self.name, result='miss' if entry is None else 'hit')
+        return default if entry is None else entry[1]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        evicted = 0
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        if evicted:
+            metrics.inc('cache_evictions_total', evicted, cache=self.name)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return None if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'capacity': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+users_by_phone = LRUCache('users_by_phone')  # phone -> users row
+phones_by_id = LRUCache('phones_by_id')      # user id -> phone
+contacts_by_user = LRUCache('contacts')      # user id -> [(contact_phone, contact_name)]
+CACHES = (users_by_phone, phones_by_id, contacts_by_user)
+
+
+def configure(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+    """Resize and empty every cache, e.g. when the app switches databases"""
+    for cache in CACHES:
+        cache.clear()
+        cache.maxsize = maxsize
+        cache.ttl = ttl
+
+
+def get_user(phone_number):
+    user = users_by_phone.get(phone_number)
+    if user is None:
+        user = database.query_one('SELECT * FROM users WHERE phone_number = ?', (phone_number,))
+        if user is not None:
+            users_by_phone.put(phone_number, user)
+            phones_by_id.put(user[0], phone_number)
+    return user
+
+
+def phones_for_users(user_ids):
+    """Map user ids to phone numbers, loading every miss in one query; unknown ids are left out"""
+    phones = {}
+    missing = []
+    for user_id in set(user_ids):
+        phone = phones_by_id.get(user_id)
+        if phone is None:
+            missing.append(user_id)
+        else:
+            phones[user_id] = phone
+
+    # Chunked to stay under SQLite's bound-parameter limit
+    for start in range(0, len(missing), 500):
+        chunk = missing[start:start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        for user_id, phone in database.query_all(
+                f'SELECT id, phone_number FROM users WHERE id IN ({placeholders})', chunk):
+            phones_by_id.put(user_id, phone)
+            phones[user_id] = phone
+    return phones
+
+
+def get_contacts(user_id):
+    contacts = contacts_by_user.get(user_id)
+    if contacts is None:
+        contacts = database.query_all('''
+            SELECT contact_phone, contact_name FROM contacts
+            WHERE user_id = ?
+        ''', (user_id,))
+        contacts_by_user.put(user_id, contacts)
+    return contacts
+
+
+def _apply_invalidation(event, data):
+    if event == 'user':
+        phone_number, user_id = data
+        users_by_phone.pop(phone_number)
+        if user_id is not None:
+            phones_by_id.pop(user_id)
+    elif event == 'contacts':
+        contacts_by_user.pop(data)
+
+
+events.listen(INVALIDATION_CHANNEL, _apply_invalidation)
+
+
+def invalidate_user(phone_number, user_id=None):
+    """Forget a user's row; pass user_id when that id no longer belongs to the phone"""
+    events.hub.broadcast(INVALIDATION_CHANNEL, 'user', [phone_number, user_id])
+
+
+def invalidate_contacts(user_id):
+    events.hub.broadcast(INVALIDATION_CHANNEL, 'contacts', user_id)
+
+
+def stats():
+    return {cache.name: cache.stats() for cache in CACHES}
@@ -0,0 +1,122 @@
+"""Group commit for message inserts: one writer thread, many writes per transaction.
+
+SQLite has a single writer, so concurrent senders used to queue on its lock
+and each pay for their own commit. Request threads now submit their write
+as a job and wait on a Future, while the writer runs the queued jobs
+together in one transaction. A batch is whatever is queued when the writer
+gets to it, up to WRITE_BATCH_ROWS rows; it never waits for more, since
+jobs submitted while a batch commits simply form the next one. Futures
+resolve only after the batch has committed, so a request still answers
+only once its rows are as durable as before. Each job runs in its own
+savepoint, so one that fails is rolled back without taking the others with it.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import database
+import metrics
+
+# 0 runs every write inline in its own transaction
+WRITE_BATCH_ROWS = int(os.environ.get('WRITE_BATCH_ROWS', 64))
+
+_STOP = object()
+
+
+class WriteQueue:
+    """Jobs queued by request threads, committed in batches by one writer thread"""
+
+    def __init__(self, batch_rows=WRITE_BATCH_ROWS):
+        self.batch_rows = batch_rows
+        self._jobs = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, job, rows=1):
+        """Run job(conn) inside a batched transaction; the Future gets its return value once committed"""
+        future = Future()
+        if self.batch_rows <= 0:
+            try:
+                with database.pool.connection() as conn:
+                    result = job(conn)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            return future
+
+        with self._lock:
+            if self._thread is None:
+                # Started on first use, so a queue built before fork gets its thread in the worker
+                self._thread = threading.Thread(target=self._run, name='write-queue', daemon=True)
+                self._thread.start()
+            self._jobs.put((job, rows, future, time.perf_counter()))
+        return future
+
+    def execute(self, job, rows=1):
+        return self.submit(job, rows).result()
+
+    def _next_batch(self, first):
+        batch = [first]
+        rows = first[1]
+        while rows < self.batch_rows:
+            try:
+                item = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._jobs.put(_STOP)  # finish this batch, then stop
+                break
+            batch.append(item)
+            rows += item[1]
+        return batch, rows
+
+    def _run(self):
+        while True:
+            first = self._jobs.get()
+            if first is _STOP:
+                return
+            batch, rows = self._next_batch(first)
+            self._commit(batch)
+            metrics.inc('write_batches_total')
+            metrics.inc('write_batch_rows_total', rows)
+
+    def _commit(self, batch):
+        results = []
+        try:
+            with database.pool.connection() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                for job, _, future, _ in batch:
+                    conn.execute('SAVEPOINT job')
+                    try:
+                        results.append((future, job(conn), None))
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO job')
+                        results.append((future, None, e))
+                    conn.execute('RELEASE job')
+        except Exception as e:
+            # The commit itself failed: nothing in the batch was written
+            for _, _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        now = time.perf_counter()
+        for (future, result, error), (_, _, _, submitted) in zip(results, batch):
+            metrics.observe('write_queue_seconds', now - submitted)
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def shutdown(self):
+        """Commit everything already submitted, then stop the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._jobs.put(_STOP)
+        if thread is not None:
+            thread.join()
+
+
+writer = WriteQueue()